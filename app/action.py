@@ -1,31 +1,45 @@
 from models import *
 from context import AppContext
 import datetime
+from zoneinfo import ZoneInfo
+from logger import get_logger
+from prefetch import GENERIC_QUERIES
+from event_body import apply_theme_color
 
-# Map high-level themes to Google Calendar colorId 
-THEME_COLOR_MAP: dict[str, str] = {
-    "Work": "#AF6C34",    
-    "Study": "#C6A868",       
-    "Exercise": "#87A390", 
-    "Wellbeing": "#87A390",  
-    "Quality Time": "#BE2E46",     
-    "Social": "#957367",     
-    "Errand": "#7F803E",     
-    "Bachelor Thesis": "#BA9504",      
-}
-
-def _apply_theme_color(event_body: dict, theme: str | None):
-    if not theme:
-        return
-    color = THEME_COLOR_MAP.get(theme.strip().title())
-    if color and 'colorId' not in event_body:
-        event_body['colorId'] = color
+logger = get_logger(__name__)
+
+def _same_time(new: dict, old: dict) -> bool:
+    """Compares an EventDateTime from a request with the one stored in Google."""
+    new_moment, old_moment = new.get('dateTime'), old.get('dateTime')
+    if new_moment is None or old_moment is None:
+        return new.get('date') == old.get('date') and new_moment == old_moment
+    if isinstance(old_moment, str):
+        old_moment = datetime.datetime.fromisoformat(old_moment)
+    time_zone = new.get('timeZone') or old.get('timeZone') or "Europe/Berlin"
+    if new_moment.tzinfo is None:
+        new_moment = new_moment.replace(tzinfo=ZoneInfo(time_zone))
+    if old_moment.tzinfo is None:
+        old_moment = old_moment.replace(tzinfo=ZoneInfo(time_zone))
+    return new_moment == old_moment and new.get('timeZone') in (None, old.get('timeZone'))
+
+def _minimal_patch(body: dict, current: dict | None) -> dict:
+    """Drops the fields of an update that already match the current version of the event."""
+    if not current:
+        return body
+    patch = {}
+    for key, value in body.items():
+        if key in ('start', 'end') and isinstance(current.get(key), dict):
+            if not _same_time(value, current[key]):
+                patch[key] = value
+        elif current.get(key) != value:
+            patch[key] = value
+    return patch
 
 def create_event_action(context: AppContext, event_model: EventCreateRequest):
     """
     This is the Protocol for creating an envent.#
     """
-    print(f"Excecuting protocol_create_event for '{event_model.summary}'")
+    logger.info("Excecuting protocol_create_event for '%s'", event_model.summary)
 
     if event_model.start.dateTime is None or event_model.end.dateTime is None:
         raise ValueError("Invalid event: Start and end times must not be None.")
@@ -37,7 +51,7 @@ def create_event_action(context: AppContext, event_model: EventCreateRequest):
 
     # Prepare body and apply theme->color mapping if provided
     body = event_model.model_dump(by_alias=True, exclude_none=True)
-    _apply_theme_color(body, getattr(event_model, 'theme', None))
+    apply_theme_color(body, getattr(event_model, 'theme', None))
 
     # Pass the event body to the calendar service
     created_event = context.calendar_service.insert_event(event_body=body)
@@ -50,8 +64,20 @@ def find_event_action(context: AppContext, time_min: datetime.datetime, time_max
     """
     if not context.calendar_service:
         raise Exception ("Calendar service not initialized.")
-    
-    found_events_raw = context.calendar_service.search_events(query=find_model.query)
+
+    # The assistant works in UTC, so naive times are UTC for the prefetch and for Google alike
+    time_min = time_min if time_min.tzinfo else time_min.replace(tzinfo=datetime.timezone.utc)
+    time_max = time_max if time_max.tzinfo else time_max.replace(tzinfo=datetime.timezone.utc)
+
+    found_events_raw = None
+    if context.prefetcher:
+        found_events_raw = context.prefetcher.lookup(find_model.query, time_min, time_max)
+    if found_events_raw is None:
+        if (find_model.query or "").strip().lower() in GENERIC_QUERIES:
+            # Nothing to search for, list the whole window instead
+            found_events_raw = context.calendar_service.list_events(time_min, time_max)
+        else:
+            found_events_raw = context.calendar_service.search_events(query=find_model.query)
 
     return [GoogleCalendarEvent(**event) for event in found_events_raw]
 
@@ -76,8 +102,16 @@ def update_event_action(context: AppContext, update_model:EventUpdateRequest):
     if not context.calendar_service:
         raise Exception("Calendar service is not initialized.")
     
-    body = update_model.model_dump(by_alias=True, exclude_none=True)
-    _apply_theme_color(body, getattr(update_model, 'theme', None))
-    updated_event = context.calendar_service.update_event(event_id=update_model.event_id, updated_data=body)
+    body = update_model.model_dump(by_alias=True, exclude_none=True, exclude={'event_id'})
+    apply_theme_color(body, getattr(update_model, 'theme', None))
+
+    # Send only what actually changes, conditional on the version we know about
+    current = context.calendar_service.cached_event(update_model.event_id)
+    body = _minimal_patch(body, current)
+    if not body:
+        return current
+    etag = update_model.etag or (current or {}).get('etag')
+
+    updated_event = context.calendar_service.update_event(event_id=update_model.event_id, updated_data=body, etag=etag)
 
     return updated_event
\ No newline at end of file
@@ -0,0 +1,155 @@
+import functools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import jsonify
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Weight of the newest request in the moving average of service time
+EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted. status is 429 (per-user limit) or 503 (overloaded)."""
+    def __init__(self, status: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits how many chat turns run at once, globally and per user.
+    Requests over the limit wait in a bounded queue until a slot frees up or their deadline passes;
+    when the queue is full they are rejected immediately with a Retry-After estimate.
+    Slots go to waiting requests in arrival order: a request only runs ahead of an earlier one whose
+    user is at their per-user limit, and new arrivals never pass a waiting request that could run.
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_per_user: int = 2, max_queue: int = 32,
+                 max_queue_per_user: int = 8, max_wait: float = 15.0):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait = max_wait
+        self._active = 0
+        self._active_by_user = {}
+        self._waiting = 0
+        self._waiting_by_user = {}
+        self._queue = deque()  # (ticket, user) of the waiting requests, in arrival order
+        self._service_time = 5.0
+        self._waits = deque(maxlen=500)
+        self._counters = {"admitted": 0, "rejected_429": 0, "rejected_503": 0, "timed_out": 0, "max_queue_depth": 0}
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def admit(self, user: str):
+        """Holds a slot for the duration of the block or raises AdmissionRejected."""
+        self._acquire(user)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(user, time.monotonic() - started)
+
+    def stats(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                "active": self._active,
+                "queued": self._waiting,
+                **self._counters,
+                "wait_p50_ms": round(waits[len(waits) // 2] * 1000) if waits else 0,
+                "wait_p95_ms": round(waits[int(len(waits) * 0.95)] * 1000) if waits else 0,
+                "service_time_ms": round(self._service_time * 1000),
+            }
+
+    def _can_run(self, user: str) -> bool:
+        return self._active < self.max_concurrent and self._active_by_user.get(user, 0) < self.max_per_user
+
+    def _first_runnable(self):
+        """Ticket of the earliest waiting request that could run now, or None."""
+        return next((ticket for ticket, user in self._queue if self._can_run(user)), None)
+
+    def _retry_after(self) -> int:
+        # Time for the queue ahead to drain at the current service rate
+        return max(1, math.ceil(self._service_time * (self._waiting + 1) / self.max_concurrent))
+
+    def _acquire(self, user: str):
+        with self._cond:
+            enqueued = time.monotonic()
+            if not self._can_run(user) or self._first_runnable() is not None:
+                if self._waiting_by_user.get(user, 0) >= self.max_queue_per_user:
+                    self._counters["rejected_429"] += 1
+                    raise AdmissionRejected(429, "Too many requests at once. Please wait a moment.", self._retry_after())
+                if self._waiting >= self.max_queue:
+                    self._counters["rejected_503"] += 1
+                    raise AdmissionRejected(503, "BillaBee is very busy right now. Please try again shortly.", self._retry_after())
+                self._wait_for_slot(user, enqueued + self.max_wait)
+
+            self._active += 1
+            self._active_by_user[user] = self._active_by_user.get(user, 0) + 1
+            self._counters["admitted"] += 1
+            self._waits.append(time.monotonic() - enqueued)
+
+    def _wait_for_slot(self, user: str, deadline: float):
+        """Waits in the queue (with the lock held by the caller) until the user can run or the deadline passes."""
+        self._waiting += 1
+        self._waiting_by_user[user] = self._waiting_by_user.get(user, 0) + 1
+        self._counters["max_queue_depth"] = max(self._counters["max_queue_depth"], self._waiting)
+        ticket = object()
+        self._queue.append((ticket, user))
+        try:
+            while not (self._can_run(user) and self._first_runnable() is ticket):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timed_out"] += 1
+                    raise AdmissionRejected(503, "BillaBee is very busy right now. Please try again shortly.", self._retry_after())
+                self._cond.wait(timeout=remaining)
+        finally:
+            self._queue.remove((ticket, user))
+            # The next request in line may be able to run now
+            self._cond.notify_all()
+            self._waiting -= 1
+            self._waiting_by_user[user] -= 1
+            if not self._waiting_by_user[user]:
+                del self._waiting_by_user[user]
+
+    def _release(self, user: str, service_time: float):
+        with self._cond:
+            self._active -= 1
+            self._active_by_user[user] -= 1
+            if not self._active_by_user[user]:
+                del self._active_by_user[user]
+            self._service_time = EWMA_ALPHA * service_time + (1 - EWMA_ALPHA) * self._service_time
+            self._cond.notify_all()
+
+
+def admission_controlled(controller: AdmissionController, user_key):
+    """
+    Decorator for Flask views: admits the request through the controller, keyed by user_key(),
+    and answers with 429/503 and a Retry-After header when it is rejected.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            user = user_key()
+            try:
+                with controller.admit(user):
+                    return view(*args, **kwargs)
+            except AdmissionRejected as e:
+                logger.warning("Rejected request of '%s' with %s (retry after %ss)", user, e.status, e.retry_after)
+                response = jsonify({"status": "error", "message": e.message})
+                response.status_code = e.status
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response
+        return wrapper
+    return decorator
@@ -0,0 +1,282 @@
+import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, Callable, Optional
+from zoneinfo import ZoneInfo
+
+from event_store import event_bounds
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Peak focus times used when a profile does not state its energy peaks as times (see the assistant's guidelines)
+DEFAULT_ENERGY_PEAKS = [("08:00", "11:00"), ("18:00", "24:00")]
+# Free time shorter than this is not offered as a slot
+MIN_SLOT_MINUTES = 30
+# Users who chatted within this many days get their agenda precomputed
+ACTIVE_DAYS = 7
+# Length of the nightly precomputation window, starting at run_at_hour
+OFF_PEAK_HOURS = 3
+# On a day without free slots, a draft is not served after this local hour anymore
+DRAFT_CUTOFF_HOUR = 10
+TIME_RANGE = re.compile(r"(\d{1,2}):(\d{2})\s*(?:-|–|to|until)\s*(\d{1,2}):(\d{2})")
+# A whole message asking to plan a day, e.g. "please plan my day" or "what should I work on tomorrow?".
+# Anchored at both ends, so scheduling commands that mention the day ("schedule a call for my day off") do not match.
+PLAN_REQUEST = re.compile(r"^(?:(?:hey|hi|billa)\W+)*(?:please\s+)?(?:(?:can|could) you\s+(?:please\s+)?)?(?:help me\s+)?"
+                          r"(?:plan\s+(?:my|the)\s+(?:day|today|tomorrow)(?:\s+(?:today|tomorrow))?"
+                          r"|plan\s+for\s+(?:today|tomorrow)|what should i (?:do|work on)\s+(?:today|tomorrow))"
+                          r"(?:\s+please)?[\s?.!]*$")
+
+
+def _at(day: datetime.date, clock: str, tz: ZoneInfo) -> datetime.datetime:
+    hours, minutes = (int(part) for part in clock.split(":")[:2])
+    if hours >= 24:
+        return datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(), tzinfo=tz)
+    return datetime.datetime.combine(day, datetime.time(hours, minutes), tzinfo=tz)
+
+
+def energy_peak_ranges(energy_peaks: Any) -> list[tuple[str, str]]:
+    """Reads "HH:MM-HH:MM" ranges or {"start", "end"} objects from a profile's free-form energy peaks."""
+    if isinstance(energy_peaks, dict) and energy_peaks.get('start') and energy_peaks.get('end'):
+        return [(energy_peaks['start'], energy_peaks['end'])]
+    if isinstance(energy_peaks, dict):
+        return [peak for value in energy_peaks.values() for peak in energy_peak_ranges(value)]
+    if isinstance(energy_peaks, list):
+        return [peak for value in energy_peaks for peak in energy_peak_ranges(value)]
+    if isinstance(energy_peaks, str):
+        return [(f"{start_h}:{start_m}", "24:00" if (end_h, end_m) == ("00", "00") else f"{end_h}:{end_m}")
+                for start_h, start_m, end_h, end_m in TIME_RANGE.findall(energy_peaks)]
+    return []
+
+
+def _subtract(intervals: list, busy: list) -> list:
+    """Removes the busy intervals from sorted, non-overlapping intervals."""
+    result = []
+    for start, end in intervals:
+        for busy_start, busy_end in busy:
+            if busy_end <= start or busy_start >= end:
+                continue
+            if busy_start > start:
+                result.append((start, busy_start))
+            start = max(start, busy_end)
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def _merge(intervals: list) -> list:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def free_slots(events: list[dict[str, Any]], day: datetime.date, tz: ZoneInfo, work_hours: Optional[dict],
+               energy_peaks: Any = None) -> list[dict[str, Any]]:
+    """
+    Free time of a day within the work hours and energy peaks, split at peak boundaries.
+    All-day events do not block time.
+    """
+    peaks = [(_at(day, start, tz), _at(day, end, tz)) for start, end in (energy_peak_ranges(energy_peaks) or DEFAULT_ENERGY_PEAKS)]
+    windows = list(peaks)
+    if work_hours and work_hours.get('start') and work_hours.get('end'):
+        windows.append((_at(day, work_hours['start'], tz), _at(day, work_hours['end'], tz)))
+
+    busy = _merge([event_bounds(event) for event in events if (event.get('start') or {}).get('dateTime')])
+    free = _subtract(_merge(windows), busy)
+    # Split at peak boundaries so that every slot is either entirely in a peak or not
+    peaks = _merge(peaks)
+    slots = []
+    for start, end in free:
+        cuts = sorted({start, end, *(moment for peak in peaks for moment in peak if start < moment < end)})
+        for slot_start, slot_end in zip(cuts, cuts[1:]):
+            if slot_end - slot_start >= datetime.timedelta(minutes=MIN_SLOT_MINUTES):
+                slots.append({
+                    "start": slot_start.strftime('%H:%M'),
+                    "end": "24:00" if slot_end.date() > day else slot_end.strftime('%H:%M'),
+                    "peak": any(peak_start <= slot_start and slot_end <= peak_end for peak_start, peak_end in peaks),
+                })
+    return slots
+
+
+def _minutes(clock: str) -> int:
+    hours, minutes = (int(part) for part in clock.split(":")[:2])
+    return hours * 60 + minutes
+
+
+def draft_still_ahead(agenda: dict[str, Any], day: datetime.date, now: datetime.datetime) -> bool:
+    """True while a draft for the agenda's day lies ahead of now, i.e. before its first free slot begins."""
+    if day != now.date():
+        return day > now.date()
+    first = agenda["free_slots"][0]["start"] if agenda["free_slots"] else f"{DRAFT_CUTOFF_HOUR:02d}:00"
+    return _minutes(now.strftime('%H:%M')) < _minutes(first)
+
+
+def remaining_agenda(agenda: dict[str, Any], day: datetime.date, now: datetime.datetime) -> dict[str, Any]:
+    """The agenda with its free slots cut to what is left of the day after now."""
+    if day != now.date():
+        return agenda
+    clock = _minutes(now.strftime('%H:%M'))
+    slots = []
+    for slot in agenda["free_slots"]:
+        start = max(_minutes(slot["start"]), clock)
+        if _minutes(slot["end"]) - start >= MIN_SLOT_MINUTES:
+            slots.append({**slot, "start": f"{start // 60:02d}:{start % 60:02d}"})
+    return {**agenda, "free_slots": slots}
+
+
+def calendar_version(events: list[dict[str, Any]]) -> str:
+    """Fingerprint of a day's events; changes whenever one of them is added, moved, edited or removed."""
+    digest = hashlib.sha1()
+    for event in sorted(events, key=lambda event: event.get('id') or ""):
+        digest.update(json.dumps([event.get('id'), event.get('etag') or event.get('updated'),
+                                  event.get('start'), event.get('end'), event.get('status')], default=str).encode())
+    return digest.hexdigest()
+
+
+def plan_request_day(message: str, timezone: Optional[str] = None) -> Optional[datetime.date]:
+    """The day a "plan my day" style message asks about, or None for any other message."""
+    text = (message or "").lower()
+    if len(text) > 200 or not PLAN_REQUEST.search(text):
+        return None
+    today = datetime.datetime.now(_zone(timezone)).date()
+    return today + datetime.timedelta(days=1) if "tomorrow" in text else today
+
+
+def _zone(timezone: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(timezone or "Europe/Berlin")
+    except Exception:
+        return ZoneInfo("Europe/Berlin")
+
+
+class AgendaScheduler:
+    """
+    Precomputes the agenda, free slots and a draft plan of the coming day for active users,
+    once a day during off-peak hours, so the morning "plan my day" request does not start from scratch.
+
+    Results are stored per user and day together with the version (fingerprint) of the calendar they
+    were computed from. A request revalidates with one cheap read: an unchanged calendar gets the
+    precomputed draft, a changed one gets a freshly computed agenda to plan from.
+    """
+
+    def __init__(self, calendar_service, draft_plan: Callable, run_at_hour: int = 3, keep_days: int = 2):
+        self.calendar_service = calendar_service
+        # draft_plan(user_profile, day, agenda) -> draft text or None
+        self.draft_plan = draft_plan
+        self.run_at_hour = run_at_hour
+        self.keep_days = keep_days
+        self._profiles = {}  # username -> (profile, last seen)
+        self._results = {}  # (username, day) -> result
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, username: str, user_profile: dict):
+        """Marks a user as active, so their days are precomputed."""
+        with self._lock:
+            self._profiles[username] = (user_profile, time.time())
+
+    def compute(self, username: str, user_profile: dict, day: datetime.date, with_draft: bool = True) -> dict[str, Any]:
+        """Computes and stores the agenda, free slots and (optionally) draft plan of a day."""
+        tz = _zone(user_profile.get('timezone'))
+        events = self._events(day, tz)
+        agenda = {
+            "date": day.isoformat(),
+            "events": [
+                {"summary": event.get('summary'), "start": (event.get('start') or {}).get('dateTime') or (event.get('start') or {}).get('date'),
+                 "end": (event.get('end') or {}).get('dateTime') or (event.get('end') or {}).get('date')}
+                for event in events
+            ],
+            "free_slots": free_slots(events, day, tz, user_profile.get('work_hours'), user_profile.get('energy_peaks')),
+        }
+        draft = None
+        if with_draft:
+            try:
+                draft = self.draft_plan(user_profile, day, agenda)
+            except Exception as e:
+                logger.error("Could not draft a plan for %s on %s: %s", username, day, e)
+
+        result = {"version": calendar_version(events), "agenda": agenda, "draft": draft,
+                  "computed_at": time.time(), "served": False}
+        with self._lock:
+            self._results[(username, day)] = result
+        return result
+
+    def lookup(self, username: str, user_profile: dict, day: datetime.date,
+               now: Optional[float] = None) -> Optional[dict[str, Any]]:
+        """
+        Revalidates the precomputed result of a day against the calendar.
+        Returns {"draft": text} the first time an unchanged result is used while the draft still lies
+        ahead, {"agenda": ...} with the free slots left after now when the calendar changed since,
+        the draft was used already or its day is under way, and None if nothing was precomputed.
+        """
+        with self._lock:
+            result = self._results.get((username, day))
+        if result is None:
+            return None
+
+        tz = _zone(user_profile.get('timezone'))
+        local_now = datetime.datetime.fromtimestamp(now or time.time(), tz)
+        events = self._events(day, tz)
+        if calendar_version(events) != result["version"]:
+            logger.info("Calendar of %s changed since the agenda of %s was precomputed.", username, day)
+            result = self.compute(username, user_profile, day, with_draft=False)
+        with self._lock:
+            if result["draft"] and not result["served"] and draft_still_ahead(result["agenda"], day, local_now):
+                result["served"] = True
+                return {"draft": result["draft"], "agenda": result["agenda"]}
+        return {"agenda": remaining_agenda(result["agenda"], day, local_now)}
+
+    def run_pending(self, now: Optional[float] = None):
+        """Precomputes the coming day of every active user who is in their local off-peak window."""
+        if not self.calendar_service.is_authenticated():
+            return
+        now = now or time.time()
+        with self._lock:
+            active = [(username, profile) for username, (profile, last_seen) in self._profiles.items()
+                      if now - last_seen < ACTIVE_DAYS * 86400]
+            # Results of past days are not needed anymore
+            oldest = datetime.date.today() - datetime.timedelta(days=self.keep_days)
+            self._results = {key: result for key, result in self._results.items() if key[1] >= oldest}
+
+        for username, profile in active:
+            local_now = datetime.datetime.fromtimestamp(now, _zone(profile.get('timezone')))
+            if (local_now.hour - self.run_at_hour) % 24 >= OFF_PEAK_HOURS:
+                continue
+            # Before noon the coming day is today, afterwards it is tomorrow
+            day = local_now.date() if local_now.hour < 12 else local_now.date() + datetime.timedelta(days=1)
+            with self._lock:
+                done = (username, day) in self._results
+            if done:
+                continue
+            try:
+                self.compute(username, profile, day)
+                logger.info("Precomputed the agenda of %s for %s.", username, day)
+            except Exception as e:
+                logger.error("Could not precompute the agenda of %s for %s: %s", username, day, e)
+
+    def start(self, interval: int = 900):
+        """Starts a background thread that checks for pending precomputations every interval seconds."""
+        if self._thread:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.run_pending()
+
+        self._thread = threading.Thread(target=loop, name="agenda-scheduler", daemon=True)
+        self._thread.start()
+
+    def _events(self, day: datetime.date, tz: ZoneInfo) -> list[dict[str, Any]]:
+        time_min = datetime.datetime.combine(day, datetime.time(), tzinfo=tz)
+        events = self.calendar_service.list_events(time_min, time_min + datetime.timedelta(days=1))
+        return [event for event in events if event.get('status') != 'cancelled']
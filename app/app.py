@@ -1,5 +1,6 @@
 import os
-from flask import Flask, request, jsonify, render_template, session
+import atexit
+from flask import Flask, request, jsonify, render_template, session, g, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
 import openai
@@ -11,9 +12,22 @@ from calendar_service import *
 from models import *
 from pydantic import ValidationError
 from context import *
+from write_queue import WRITE_OWNER
 from action import *
 from dateutil.parser import parse
 from setup_credentials import create_credentials_file
+from plan_executor import execute_plan_action, PlanValidationError
+from push_notifications import EventMirror, ChannelManager
+from context_window import fit_history, truncate_summary
+from model_router import ModelRouter
+from profiler import profiled
+from admission import AdmissionController, admission_controlled
+from ics_export import CalendarExport
+from fast_path import recognize_read_intent, render_agenda
+from agenda_scheduler import AgendaScheduler, plan_request_day
+from logger import setup_logging, get_logger, Payload, REQUEST_ID, dropped_records
+from deadline import DeadlineExceeded, current_deadline, deadline_scope, deadline_stats, exceeded
+import uuid
 
 # Load environment variables from .env file
 script_dir = Path(__file__).parent
@@ -25,6 +39,9 @@ try:
 except Exception as e:
     print(f"Error loading .env file: {e}")
 
+setup_logging()
+logger = get_logger("app")
+
 # Create credentials.json from environment variables
 create_credentials_file()
 
@@ -40,13 +57,66 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 
 app_context = AppContext()
 
+# Token budget for the verbatim chat history sent to the assistant, and for the rolling summary
+CONTEXT_BUDGET_TOKENS = int(os.getenv('BILLABEE_CONTEXT_BUDGET', '3000'))
+SUMMARY_BUDGET_TOKENS = int(os.getenv('BILLABEE_SUMMARY_BUDGET', '400'))
+# Time budget (seconds) for answering one chat message, shared by all model and calendar calls
+CHAT_DEADLINE_SECONDS = float(os.getenv('BILLABEE_CHAT_DEADLINE', '45'))
+
+# Per-stage model routing: planner, translator (instruction -> tool JSON) and summarizer
+model_router = ModelRouter()
+# Admission control: global and per-user limits on concurrently running chat turns
+chat_admission = AdmissionController(
+    max_concurrent=int(os.getenv('BILLABEE_MAX_CONCURRENT_CHATS', '8')),
+    max_per_user=int(os.getenv('BILLABEE_MAX_CHATS_PER_USER', '2')),
+    max_queue=int(os.getenv('BILLABEE_CHAT_QUEUE_SIZE', '32')),
+    max_queue_per_user=int(os.getenv('BILLABEE_CHAT_QUEUE_SIZE_PER_USER', '8')),
+    max_wait=float(os.getenv('BILLABEE_CHAT_QUEUE_TIMEOUT', '15'))
+)
+
+# Tool errors raised before anything was executed; the translation is retried with the strongest model
+RETRYABLE_TOOL_ERRORS = ("Invalid JSON from AI.", "Invalid parameters from AI.", "Invalid plan from AI.")
+
+# Push notifications keep a local mirror of the calendar fresh instead of re-fetching every turn
+channel_manager = None
+webhook_url = os.getenv('BILLABEE_WEBHOOK_URL')
+if webhook_url and app_context.calendar_service and app_context.calendar_service.is_authenticated():
+    google_service = app_context.calendar_service
+    if app_context.write_queue:
+        google_service = app_context.write_queue.calendar_service
+    # Shared by the worker processes, so a notification reaching any of them refreshes all mirrors
+    webhook_state_dir = os.getenv('BILLABEE_WEBHOOK_STATE_DIR')
+    google_service.mirror = EventMirror(
+        google_service,
+        max_age=float(os.getenv('BILLABEE_MIRROR_MAX_AGE', '300')),
+        shared_dir=webhook_state_dir
+    )
+    channel_manager = ChannelManager(
+        google_service,
+        google_service.mirror,
+        address=webhook_url,
+        token=os.getenv('BILLABEE_WEBHOOK_TOKEN'),
+        ttl=int(os.getenv('BILLABEE_WEBHOOK_TTL', '604800')),
+        shared_dir=webhook_state_dir
+    )
+    try:
+        for calendar_id in os.getenv('BILLABEE_WATCH_CALENDARS', 'primary').split(','):
+            channel_manager.register(calendar_id.strip())
+        channel_manager.start_renewal()
+        google_service.mirror.start_periodic_resync()
+        if not webhook_state_dir:
+            # Shared channels outlive a single worker
+            atexit.register(channel_manager.teardown)
+    except Exception as e:
+        logger.warning("Could not register calendar push notifications: %s", e)
+
 def load_user_profile(filename):
     with open(filename, 'r') as f:
         return json.load(f)
 
 # --- AI LOGIC ---
 
-def get_tool_user_response(user_message, history = None):
+def get_tool_user_response(user_message, history = None, escalate = False):
     """ Sends a message to the OpenAI API and returns the response. """
 
     now = datetime.datetime.now().isoformat()
@@ -104,8 +174,10 @@ def get_tool_user_response(user_message, history = None):
 
     4. tool_name: "update_event"
         - Use this ONLY to update an event when you ALREADY have the event_id.
+        - Only include the fields that change.
         - parameters: {{
             "event_id": "<The specific ID of the event to update>",
+            "etag": "<string, optional: the etag of the event if it is known>",
             "summary": "<string, optional>",
             "description": "<string, optional>",
             "theme": "<string, optional>",
@@ -120,7 +192,18 @@ def get_tool_user_response(user_message, history = None):
             }}
         }}
 
-    5. tool_name: "reply_text"
+    5. tool_name: "execute_plan"
+        - Use this to execute a whole agreed plan of several event changes at once.
+        - Put EVERY step of the plan into "operations", in order. Each "parameters" object follows the matching tool above.
+        - parameters: {{
+            "operations": [
+                {{"action": "create", "parameters": {{<parameters of "create_event">}}}},
+                {{"action": "update", "parameters": {{<parameters of "update_event">}}}},
+                {{"action": "delete", "parameters": {{<parameters of "delete_event">}}}}
+            ]
+        }}
+
+    6. tool_name: "reply_text"
         - Use this for any request that is not an action, like a greeting, a question, or if you cannot understand the request.
         - parameters: {{
             "text": "<A friendly, helpful text response to the user>"
@@ -134,19 +217,50 @@ def get_tool_user_response(user_message, history = None):
 
         messages.append({"role": "user", "content": user_message})
 
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
+        return model_router.complete(
+            "translator",
+            messages,
+            escalate=escalate,
             temperature=0.7,
-            max_tokens=150
+            max_tokens=1500
         )
-        content = response.choices[0].message.content
-        return content.strip() if content is not None else ""
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"Error communicating with OpenAI API: {e}")
+        logger.error("Error communicating with OpenAI API: %s", e)
         return "Oh, honey! My antennae are a bit fuzzy right now. I couldn't connect to the hive. Please try again later."
     
-def get_personal_assistant_response(user_message, user_profile, history=None):
+def summarize_history(summary, messages):
+    """ Folds older chat messages into the rolling conversation summary. """
+    transcript = "\n".join(f"{message['role']}: {message.get('content') or ''}" for message in messages)
+    summary_prompt = f"""
+    You maintain a running summary of a conversation between a user and their planning assistant.
+    Update the summary with the new messages below. Keep agreed plans, decisions, event names, dates,
+    times and open questions. Drop greetings and small talk. Answer with the updated summary only.
+
+    --- Current summary ---
+    {summary or "(empty)"}
+
+    --- New messages ---
+    {transcript}
+    """
+    try:
+        content = model_router.complete(
+            "summarizer",
+            [{"role": "system", "content": summary_prompt}],
+            temperature=0.2,
+            max_tokens=SUMMARY_BUDGET_TOKENS
+        )
+        if content:
+            return content
+    except DeadlineExceeded:
+        # Out of time for a model call, keep the turn going with the cheap fallback
+        pass
+    except Exception as e:
+        logger.error("Error communicating with OpenAI (Summarizer): %s", e)
+    return truncate_summary(summary, messages, SUMMARY_BUDGET_TOKENS)
+
+def get_personal_assistant_response(user_message, user_profile, history=None, summary=None):
 
     priorities_text = "\n- ".join(user_profile['priorities'])
 
@@ -213,9 +327,10 @@ def get_personal_assistant_response(user_message, user_profile, history=None):
 
     **4. Act on User Agreement:**
     - After you have proposed a plan and the user agrees (e.g., they say "yes", "sounds good", "perfect"), your next job is to execute that plan.
-    - You must break down the plan into a series of simple, one-at-a-time instructions for the tool-using system.
-    - Your response should be the **first instruction** in the sequence.
-    - **Example Execution Instruction:** "Okay, now I will create an event for 'Thesis Work' from 2pm to 5pm today."
+    - If the plan changes more than one event, execute the WHOLE plan with a single instruction for the tool-using system.
+    - Your response must start with "Okay, now I will execute the plan:" followed by every step with its exact date, start and end time.
+    - **Example Execution Instruction:** "Okay, now I will execute the plan: create an event 'Thesis Work' today from 2pm to 5pm, create an event 'Meditation' today from 6pm to 6:20pm."
+    - If only one event changes, a single instruction is enough, e.g. "Okay, now I will create an event for 'Thesis Work' from 2pm to 5pm today."
 
     Remember: your job is not just scheduling — you are {user_profile['name']} supportive planning partner.
     """
@@ -224,23 +339,36 @@ def get_personal_assistant_response(user_message, user_profile, history=None):
 
     messages.insert(0, {"role": "system", "content": personal_assistant_prompt})
 
+    if summary:
+        messages.insert(1, {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+
     messages.append({"role": "user", "content": user_message})
 
     try:
-        response = openai.chat.completions.create(
-            model = "gpt-4o", 
-            messages=messages, 
-            temperature=0.7, 
+        return model_router.complete(
+            "planner",
+            messages,
+            temperature=0.7,
             max_tokens=250
         )
-        content = response.choices[0].message.content
-        return content.strip() if content is not None else ""
     
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"Error communicating with OpenAI (Personal Assistant): {e}")
+        logger.error("Error communicating with OpenAI (Personal Assistant): %s", e)
         return "Oh dear, my bee-brain is buzzing with an error. Please try again."
 
 
+def draft_day_plan(user_profile, day, agenda):
+    """ Drafts a plan for a precomputed agenda with the assistant, off the request path. """
+    history = [{"role": "assistant", "content": f"OBSERVATION: {json.dumps(agenda, default=json_datetime_serializer)}"}]
+    with deadline_scope(CHAT_DEADLINE_SECONDS):
+        pa_response = get_personal_assistant_response(f"Plan my day for {day.strftime('%A, %d %B')}.", user_profile, history=history)
+    if "FINAL ANSWER:" not in pa_response:
+        return None
+    return pa_response.replace("FINAL ANSWER:", "").strip()
+
+
 def split_json_text(bot_response):
     try:
         parsed = json.loads(bot_response)
@@ -254,6 +382,19 @@ def clean_json_string(json_str):
     # Remove ```json and ``` if present
     return re.sub(r"```(?:json)?\s*|\s*```", "", json_str).strip() 
 
+def start_prefetch(user_profile):
+    """ Speculatively loads the user's upcoming events in the background. """
+    calendar_service = app_context.calendar_service
+    if app_context.prefetcher and calendar_service and calendar_service.is_authenticated():
+        app_context.prefetcher.start(user_profile.get('timezone'))
+
+# Nightly precomputation of the coming day's agenda and a draft plan for active users
+agenda_scheduler = None
+precompute_hour = os.getenv('BILLABEE_PRECOMPUTE_HOUR', '3')
+if app_context.calendar_service and precompute_hour.lower() not in ('', 'off'):
+    agenda_scheduler = AgendaScheduler(app_context.calendar_service, draft_day_plan, run_at_hour=int(precompute_hour))
+    agenda_scheduler.start()
+
 def execute_tool(tool_json_str):
     """
     Parses a JSON string, identifies the tool, and executes the corresponding action.
@@ -265,6 +406,10 @@ def execute_tool(tool_json_str):
         tool_name = parsed.get("tool_name")
         parameters = parsed.get("parameters", {})
 
+        # Prefetched events are stale once the calendar is changed
+        if tool_name in ("create_event", "delete_event", "update_event", "execute_plan") and app_context.prefetcher:
+            app_context.prefetcher.invalidate()
+
         if tool_name == "find_event":
             find_model = FindEventRequest(**parameters)
             time_min = find_model.time_min
@@ -288,16 +433,35 @@ def execute_tool(tool_json_str):
             update_event_model = update_event_action(app_context, update_model)
             return update_event_model
 
+        elif tool_name == "execute_plan":
+            plan_model = ExecutePlanRequest(**parameters)
+            return execute_plan_action(app_context, plan_model)
+
         else:
             return {"error": f"Unknow tool name: {tool_name}"}
+
+    except EventConflictError as e:
+        # The event was edited elsewhere since it was read
+        return {"error": "The event was changed in the meantime. Please look it up again.", "details": str(e)}
+
+    except PlanValidationError as e:
+        # Nothing was executed, one of the plan operations is malformed
+        return {"error": "Invalid plan from AI.", "failed_operation": e.index, "details": e.details}
         
     except ValidationError as e:
         # If the AI's parameters are wrong 
         return {"error": "Invalid parameters from AI.", "details": e.errors()}
+
+    except json.JSONDecodeError as e:
+        # If the AI did not answer with valid JSON
+        return {"error": "Invalid JSON from AI.", "details": str(e)}
+
+    except DeadlineExceeded:
+        raise
         
     except Exception as e:
         # General catch-all for other error
-        print(f"!!! An unexpected error occurred in execute_tool: {e} !!!")
+        logger.error("An unexpected error occurred in execute_tool: %s", e)
         return {"error": "An internal server error occurred during tool execution."}
     
 def json_datetime_serializer(obj):
@@ -319,16 +483,84 @@ def summarize_tool_result(tool_name, tool_result):
         summary = []
         for event in tool_result:
             summary.append({
+                "id": event.get("id"),
+                "etag": event.get("etag"),
                 "summary": event.get("summary"),
                 "start": event.get("start", {}).get("dateTime"),
                 "end": event.get("end", {}).get("dateTime")
             })
         return summary
+    elif tool_name == "execute_plan" and isinstance(tool_result, dict):
+        return {
+            "status": tool_result.get("status"),
+            "message": tool_result.get("message"),
+            "events": [
+                {"summary": event.get("summary"), "start": event.get("start", {}).get("dateTime")}
+                for event in tool_result.get("results", []) if isinstance(event, dict) and "start" in event
+            ]
+        }
     else:
         return tool_result
+
+
+def _readable_time(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat()
+    try:
+        return datetime.datetime.fromisoformat(value).strftime('%a %d %b %H:%M')
+    except (TypeError, ValueError):
+        return value or "no time"
+
+
+def describe_tool_result(tool_name, summarized_result):
+    """
+    Describes a summarized tool result in plain words for the user,
+    without the ids and etags that are only meant for the AI.
+    """
+    if tool_name == "find_event" and isinstance(summarized_result, list):
+        if not summarized_result:
+            return "I did not find any matching events."
+        lines = ["I found these events:"]
+        lines += [f"- {_readable_time(event.get('start'))}: {event.get('summary') or '(no title)'}" for event in summarized_result]
+        return "\n".join(lines)
+    if isinstance(summarized_result, dict) and summarized_result.get("message"):
+        lines = [summarized_result["message"]]
+        lines += [f"- {_readable_time(event.get('start'))}: {event.get('summary') or '(no title)'}"
+                  for event in summarized_result.get("events", [])]
+        return "\n".join(lines)
+    return None
   
 
 # --- ROUTES ---
+@app.before_request
+def assign_request_id():
+    """ Correlate all log records of a request. """
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_id_token = REQUEST_ID.set(g.request_id)
+
+
+@app.before_request
+def assign_write_owner():
+    """ Queued calendar writes remember the user they were made for. """
+    g.write_owner_token = WRITE_OWNER.set(session.get('current_user', 'Martina'))
+
+
+@app.after_request
+def expose_request_id(response):
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    return response
+
+
+@app.teardown_request
+def reset_request_id(exc):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        REQUEST_ID.reset(token)
+    token = g.pop('write_owner_token', None)
+    if token is not None:
+        WRITE_OWNER.reset(token)
+
+
 @app.route('/api/set_user', methods=['POST'])
 def set_user():
     data = request.json
@@ -348,7 +580,11 @@ def set_user():
         session['current_user'] = username
         # Clear chat history when switching users
         session['chat_history'] = []
-        print(f"Session user set to: {username}")
+        session['history_summary'] = ""
+        logger.info("Session user set to: %s", username)
+        start_prefetch(user_profile)
+        if agenda_scheduler:
+            agenda_scheduler.track(username, user_profile)
         
         return jsonify({
             "status": "success",
@@ -366,12 +602,59 @@ def set_user():
         }), 500
 
 
+def answer_read_fast(user_message, user_profile):
+    """ Answers simple agenda reads ("what do I have tomorrow") without the assistant, or returns None. """
+    calendar_service = app_context.calendar_service
+    if not calendar_service or not calendar_service.is_authenticated():
+        return None
+    intent = recognize_read_intent(user_message, user_profile.get('timezone'))
+    if intent is None:
+        return None
+    try:
+        find_model = FindEventRequest(query="", timeMin=intent["time_min"], timeMax=intent["time_max"])
+        events = find_event_action(app_context, intent["time_min"], intent["time_max"], find_model)
+    except Exception as e:
+        # Runs under the turn's deadline, so after a timeout the assistant loop gives up right away
+        logger.warning("Fast path lookup failed, handing over to the assistant: %s", e)
+        return None
+    logger.info("Answered read of %s events %s on the fast path.", len(events), intent["label"])
+    return render_agenda(events, intent)
+
+
+def precomputed_plan(username, user_profile, user_message):
+    """ Returns the precomputed result for a "plan my day" message ({"draft"} and/or {"agenda"}), or None. """
+    if agenda_scheduler is None:
+        return None
+    day = plan_request_day(user_message, user_profile.get('timezone'))
+    if day is None:
+        return None
+    try:
+        return agenda_scheduler.lookup(username, user_profile, day)
+    except Exception as e:
+        logger.warning("Could not revalidate the precomputed agenda, planning from scratch: %s", e)
+        return None
+
+
+def chat_user_key():
+    """ Key for per-user admission limits. """
+    return session.get('current_user') or request.remote_addr or "anonymous"
+
+
 @app.route('/api/chat', methods=['POST'])
+@profiled
+@admission_controlled(chat_admission, chat_user_key)
 def chat_api():
     data = request.json
     if data is None: 
         return jsonify({'response': "No JSON data received."}), 400
-    
+
+    # One time budget for the whole turn: fast path, precomputed plan and the assistant loop
+    with deadline_scope(CHAT_DEADLINE_SECONDS):
+        return chat_turn(data)
+
+
+def chat_turn(data):
+    """ Answers one chat message; runs under the deadline of the /api/chat request. """
     username = session.get('current_user', 'Martina')
     profile_filename = f"user_profile_{username}.json"
 
@@ -380,65 +663,200 @@ def chat_api():
     except FileNotFoundError:
         return jsonify({f"Profile for user '{username}' not found."}), 404
     
+    # Runs alongside the planner call below
+    start_prefetch(user_profile)
+    if agenda_scheduler:
+        agenda_scheduler.track(username, user_profile)
+
     history = session.get('chat_history', [])
+    summary = session.get('history_summary', "")
     user_message = data.get('message')
-    history.append({"role": "user", "content": user_message})
-
-    for _ in range(5): 
-        
-        pa_response = get_personal_assistant_response(user_message, user_profile, history=history)
-        history.append({"role": "assistant", "content": pa_response})
 
-        if "FINAL ANSWER:" in pa_response:
-            print("--- PA has a final answer. Ending loop. ---")
-            final_message = pa_response.replace("FINAL ANSWER:", "").strip()
-            session['chat_history'] = history
-            return jsonify({
-                "status": "success",
-                "tool_name": "reply_text",
-                "data": {"text": final_message}
-            })
-        
-        is_tool_request = "check the calendar" in pa_response.lower() or \
-                          "find the event" in pa_response.lower() or \
-                          "create an event" in pa_response.lower() or \
-                          "delete the event" in pa_response.lower() or \
-                          "update the event" in pa_response.lower()
-        
-        if is_tool_request:
-            print(f"--- PA wants to use a tool: '{pa_response}' ---")
-            tool_json_str = get_tool_user_response(pa_response)
-
-            try:
-                tool_name = json.loads(clean_json_string(tool_json_str)).get("tool_name")
-            except (json.JSONDecodeError, AttributeError):
-                tool_name = None
-
-            tool_result = execute_tool(tool_json_str)
-            print(f"--- Tool Result: {tool_result} ---")
-
-            if isinstance(tool_result, dict) and "error" in tool_result:
-                return jsonify({"status": "error", "message": "A tool failed to execute.", "details": tool_result})
-            
-            summarized_result = summarize_tool_result(tool_name, tool_result)
+    # Tell the assistant about queued calendar writes that failed since the last turn
+    failures = None
+    if app_context.write_queue:
+        failures = app_context.write_queue.drain_failures(username)
+        if failures:
             history.append({
                 "role": "assistant",
-                "content": f"OBSERVATION: {json.dumps(summarized_result, default=json_datetime_serializer)}"
+                "content": f"OBSERVATION: These calendar changes could not be saved: {json.dumps(failures, default=json_datetime_serializer)}"
             })
-            continue
-        
+
+    history.append({"role": "user", "content": user_message})
+
+    # Simple agenda reads skip the assistant, unless there are failed writes to report
+    fast_answer = None if failures else answer_read_fast(user_message, user_profile)
+    if fast_answer is not None:
+        history.append({"role": "assistant", "content": fast_answer})
+        session['chat_history'] = history
+        session['history_summary'] = summary
+        return jsonify({
+            "status": "success",
+            "tool_name": "reply_text",
+            "data": {"text": fast_answer}
+        })
+
+    # "Plan my day": use the plan drafted overnight if the calendar is unchanged, else start from its agenda
+    precomputed = None if failures else precomputed_plan(username, user_profile, user_message)
+    if precomputed and precomputed.get("draft"):
+        logger.info("Answered with the precomputed plan of %s.", username)
+        history.append({"role": "assistant", "content": precomputed["draft"]})
+        session['chat_history'] = history
+        session['history_summary'] = summary
+        return jsonify({
+            "status": "success",
+            "tool_name": "reply_text",
+            "data": {"text": precomputed["draft"]}
+        })
+    if precomputed:
+        history.append({
+            "role": "assistant",
+            "content": f"OBSERVATION: {json.dumps(precomputed['agenda'], default=json_datetime_serializer)}"
+        })
+
+    # Results of the tools run in this turn, the best partial answer if time runs out
+    observations = []
+
+    try:
+        deadline = current_deadline()
+        for _ in range(5):
+            if deadline.expired():
+                raise exceeded('chat_loop')
+
+            # Keep the input size flat: older turns are folded into the rolling summary
+            history, summary = fit_history(history, summary, CONTEXT_BUDGET_TOKENS, summarize_history)
+            pa_response = get_personal_assistant_response(user_message, user_profile, history=history, summary=summary)
+            history.append({"role": "assistant", "content": pa_response})
+
+            if "FINAL ANSWER:" in pa_response:
+                logger.info("PA has a final answer. Ending loop.")
+                final_message = pa_response.replace("FINAL ANSWER:", "").strip()
+                session['chat_history'] = history
+                session['history_summary'] = summary
+                return jsonify({
+                    "status": "success",
+                    "tool_name": "reply_text",
+                    "data": {"text": final_message}
+                })
+
+            is_tool_request = "check the calendar" in pa_response.lower() or \
+                              "find the event" in pa_response.lower() or \
+                              "create an event" in pa_response.lower() or \
+                              "delete the event" in pa_response.lower() or \
+                              "update the event" in pa_response.lower() or \
+                              "execute the plan" in pa_response.lower()
+
+            if is_tool_request:
+                logger.info("PA wants to use a tool: '%s'", pa_response)
+                tool_json_str = get_tool_user_response(pa_response)
+                tool_result = execute_tool(tool_json_str)
+
+                if isinstance(tool_result, dict) and tool_result.get("error") in RETRYABLE_TOOL_ERRORS:
+                    logger.warning("Translation failed validation (%s). Retrying with the strongest model.", tool_result['error'])
+                    tool_json_str = get_tool_user_response(pa_response, escalate=True)
+                    tool_result = execute_tool(tool_json_str)
+
+                try:
+                    tool_name = json.loads(clean_json_string(tool_json_str)).get("tool_name")
+                except (json.JSONDecodeError, AttributeError):
+                    tool_name = None
+
+                logger.info("Tool Result: %s", Payload(tool_result), extra={"verbose": True})
+
+                if isinstance(tool_result, dict) and "error" in tool_result:
+                    return jsonify({"status": "error", "message": "A tool failed to execute.", "details": tool_result})
+
+                summarized_result = summarize_tool_result(tool_name, tool_result)
+                observation = json.dumps(summarized_result, default=json_datetime_serializer)
+                observations.append((tool_name, summarized_result))
+                history.append({
+                    "role": "assistant",
+                    "content": f"OBSERVATION: {observation}"
+                })
+                continue
+
+            else:
+                logger.info("PA has finished executing. Ending loop.")
+                session['chat_history'] = history
+                session['history_summary'] = summary
+                return jsonify({
+                    "status": "success",
+                    "tool_name": "reply_text",
+                    "data": {"text": pa_response}
+                })
+
+    except DeadlineExceeded as e:
+        logger.warning("Chat turn ran out of time during %s after %s tool calls.", e.stage, len(observations))
+        found = describe_tool_result(*observations[-1]) if observations else None
+        if found:
+            text = f"I ran out of time before finishing, honey. Here is what I found so far:\n{found}"
         else:
-            print("--- PA has finished executing. Ending loop. ---")
-            session['chat_history'] = history
-            return jsonify({
-                "status": "success",
-                "tool_name": "reply_text",
-                "data": {"text": pa_response}
-            })
-        
+            text = "I ran out of time before finishing, honey. Please try again in a moment."
+        history.append({"role": "assistant", "content": text})
+        session['chat_history'] = history
+        session['history_summary'] = summary
+        return jsonify({
+            "status": "success",
+            "tool_name": "reply_text",
+            "partial": True,
+            "data": {"text": text}
+        })
+
     return jsonify({"status": "error", "message": "The assistant took too many steps. Please try again."})
 
 
+@app.route('/api/export.ics')
+def export_ics():
+    """ Stream the calendar as an iCalendar file. Query parameters: start, end (YYYY-MM-DD), calendar (repeatable). """
+    calendar_service = app_context.calendar_service
+    if not calendar_service or not calendar_service.is_authenticated():
+        return jsonify({"status": "error", "message": "Not authenticated with Google Calendar."}), 401
+
+    try:
+        today = datetime.date.today()
+        start = datetime.date.fromisoformat(request.args.get('start', (today - datetime.timedelta(days=365)).isoformat()))
+        end = datetime.date.fromisoformat(request.args.get('end', (today + datetime.timedelta(days=365)).isoformat()))
+    except ValueError:
+        return jsonify({"status": "error", "message": "start and end must be dates in YYYY-MM-DD format."}), 400
+    if end <= start:
+        return jsonify({"status": "error", "message": "end must be after start."}), 400
+
+    # Export what the user sees, including queued changes
+    if app_context.write_queue:
+        app_context.write_queue.flush(timeout=5)
+
+    time_min = datetime.datetime.combine(start, datetime.time(), tzinfo=datetime.timezone.utc)
+    time_max = datetime.datetime.combine(end, datetime.time(), tzinfo=datetime.timezone.utc)
+    export = CalendarExport(calendar_service, request.args.getlist('calendar') or ['primary'], time_min, time_max)
+
+    # HTTP dates have second precision
+    last_modified = export.last_modified.replace(microsecond=0) if export.last_modified else None
+    not_modified = request.if_none_match.contains(export.etag) if request.if_none_match else \
+        bool(request.if_modified_since and last_modified and last_modified <= request.if_modified_since)
+
+    response = Response(None if not_modified else export.iter_chunks(), status=304 if not_modified else 200, mimetype='text/calendar')
+    response.set_etag(export.etag)
+    response.last_modified = last_modified
+    response.headers['Content-Disposition'] = f'attachment; filename="billabee-{start}-{end}.ics"'
+    return response
+
+
+@app.route('/api/metrics')
+def metrics_api():
+    """ Expose runtime metrics such as per-model latency. """
+    return jsonify({
+        "models": model_router.stats(),
+        "admission": chat_admission.stats(),
+        "calendar": {
+            "shared_reads": app_context.calendar_service._single_flight.shared if app_context.calendar_service else 0,
+            "shared_cache": app_context.calendar_service.shared_cache.stats()
+            if app_context.calendar_service and app_context.calendar_service.shared_cache else None
+        },
+        "logging": {"dropped_records": dropped_records()},
+        "deadlines": deadline_stats()
+    })
+
+
 @app.route('/')
 def home():
     """ Serve the index.html file. """
@@ -461,13 +879,36 @@ def google_login():
                 "message": "Authentication failed or was cancelled"
             }), 400
     except Exception as e:
-        print(f"Error initiating OAuth: {e}")
+        logger.error("Error initiating OAuth: %s", e)
         return jsonify({
             "status": "error",
             "message": f"Failed to initiate login: {str(e)}"
         }), 500
 
 
+@app.route('/google/notifications', methods=['POST'])
+def google_notifications():
+    """Webhook for Google Calendar push notifications."""
+    if channel_manager is None:
+        return "", 404
+    if not channel_manager.handle_notification(request.headers):
+        return "", 403
+    return "", 200
+
+
+@app.route('/google/channels')
+def google_channels():
+    """List the active push notification channels."""
+    if channel_manager is None:
+        return jsonify({"channels": []})
+    return jsonify({
+        "channels": [
+            {"id": channel_id, "calendar_id": channel["calendar_id"], "expiration": channel["expiration"]}
+            for channel_id, channel in list(channel_manager.channels.items())
+        ]
+    })
+
+
 @app.route('/google/status')
 def google_status():
     """Check if user is authenticated with Google Calendar."""
@@ -8,9 +8,29 @@ from googleapiclient.errors import HttpError
 from typing import Any, Optional
 from zoneinfo import ZoneInfo
 import secrets
+import threading
+from singleflight import SingleFlight
+from event_body import serialize_datetimes
+from constants import MAX_EVENTS
+from deadline import call_timeout, current_deadline, deadline_scope, exceeded
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
+from logger import get_logger
+
+logger = get_logger(__name__)
 
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+# Time budget (seconds) of a background reload of the shared cache's calendar window
+SHARED_CACHE_LOAD_TIMEOUT = 60.0
+# Fields Google sets itself; they are stripped from bodies that replace a whole event
+READ_ONLY_FIELDS = ('kind', 'sequence', 'etag', 'created', 'updated', 'htmlLink', 'creator', 'iCalUID')
+
+
+class EventConflictError(Exception):
+    """Raised when an event was changed by someone else since the given ETag was read."""
+    pass
+
 
 class GoogleCalendarService:
     def __init__(self, token_path = 'token.json', creds_path='credentials.json'):
@@ -18,29 +38,37 @@ class GoogleCalendarService:
         self.creds_path = creds_path
         self.creds = None
         self.service = None
+        # Optional local mirror kept fresh by push notifications (see push_notifications.py)
+        self.mirror = None
+        # Deduplicates identical reads that are in flight at the same time
+        self._single_flight = SingleFlight()
+        # Authorized Http per thread for calls under a deadline (httplib2 is not thread-safe)
+        self._local = threading.local()
+        # Optional event cache shared with the other worker processes on this host (see shared_cache.py)
+        self.shared_cache = None
 
         # Try to load existing credentials, but don't crash if they don't exist
         if os.path.exists(token_path):
             self.creds = Credentials.from_authorized_user_file(token_path, SCOPES)
             if self.creds and self.creds.valid:
                 self.service = build('calendar', 'v3', credentials=self.creds)
-                print('Google Calendar Service successfully initialized.')
+                logger.info("Google Calendar Service successfully initialized.")
             elif self.creds and self.creds.expired and self.creds.refresh_token:
                 try:
                     self.creds.refresh(Request())
                     with open(token_path, 'w') as token:
                         token.write(self.creds.to_json())
                     self.service = build('calendar', 'v3', credentials=self.creds)
-                    print('Credentials refreshed. Google Calendar Service successfully initialized.')
+                    logger.info("Credentials refreshed. Google Calendar Service successfully initialized.")
                 except Exception as e:
-                    print(f'Failed to refresh credentials: {e}')
+                    logger.error("Failed to refresh credentials: %s", e)
                     self.creds = None
                     self.service = None
             else:
-                print('Token exists but is invalid and cannot be refreshed.')
+                logger.warning("Token exists but is invalid and cannot be refreshed.")
                 self.creds = None
         else:
-            print('No token.json found. User needs to authenticate via /google/login.')
+            logger.info("No token.json found. User needs to authenticate via /google/login.")
 
     def is_authenticated(self) -> bool:
         """Check if the service has valid credentials."""
@@ -75,11 +103,11 @@ class GoogleCalendarService:
             
             # Initialize the service
             self.service = build('calendar', 'v3', credentials=self.creds)
-            print('Authentication successful! Token saved and Google Calendar Service initialized.')
+            logger.info("Authentication successful! Token saved and Google Calendar Service initialized.")
             return True
             
         except Exception as e:
-            print(f"Authentication failed: {e}")
+            logger.error("Authentication failed: %s", e)
             return False
 
     def _ensure_valid_credentials(self):
@@ -92,7 +120,7 @@ class GoogleCalendarService:
                 self.creds.refresh(Request())
                 with open(self.token_path, 'w') as token:
                     token.write(self.creds.to_json())
-                print('Credentials refreshed automatically.')
+                logger.info("Credentials refreshed automatically.")
             except Exception as e:
                 raise Exception(f"Failed to refresh credentials: {e}")
         
@@ -100,6 +128,58 @@ class GoogleCalendarService:
             self.service = build('calendar', 'v3', credentials=self.creds)
 
 
+    def _execute(self, api_request):
+        """
+        Executes a Google API request. Inside a request deadline, the HTTP timeout is
+        set to the remaining time budget.
+        """
+        timeout = call_timeout('calendar')
+        if timeout is None:
+            return api_request.execute()
+        try:
+            return api_request.execute(http=self._thread_http(timeout))
+        except TimeoutError:
+            deadline = current_deadline()
+            if deadline and deadline.expired():
+                raise exceeded('calendar')
+            raise
+
+    def _thread_http(self, timeout: float):
+        """
+        The current thread's authorized Http with its timeout set to `timeout`.
+        It is reused across calls, so open connections are kept instead of paying a new handshake per call.
+        """
+        http = getattr(self._local, 'http', None)
+        if http is None or http.credentials is not self.creds:
+            http = self._local.http = AuthorizedHttp(self.creds, http=httplib2.Http())
+        # New connections take the timeout from Http, open ones from their socket
+        http.http.timeout = timeout
+        for connection in http.http.connections.values():
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+        return http
+
+    def _shared_read(self, key, read, *args):
+        """
+        Runs a read through the single-flight layer, so identical reads in flight share one request.
+        Followers wait at most until the request deadline.
+        """
+        try:
+            return self._single_flight.do(key, read, *args, timeout=call_timeout('calendar'))
+        except TimeoutError:
+            deadline = current_deadline()
+            if deadline and deadline.expired():
+                raise exceeded('calendar')
+            raise
+
+    def _after_write(self, calendar_id: str, event: Optional[dict] = None, deleted_id: Optional[str] = None):
+        """Brings the local mirror and the shared cache up to date with a write we just made."""
+        if self.mirror:
+            self.mirror.apply_write(calendar_id, event=event, deleted_id=deleted_id)
+        if self.shared_cache:
+            self.shared_cache.invalidate(calendar_id)
+
     def insert_event(self, event_body: dict[str, Any]):
         """
         Inserts an event into the primary calendar using a pre-validated dictionary.
@@ -107,46 +187,149 @@ class GoogleCalendarService:
         self._ensure_valid_credentials()
 
         try: 
-            if 'start' in event_body and 'dateTime' in event_body['start']:
-                event_body['start']['dateTime'] = event_body['start']['dateTime'].isoformat()
-        
-            if 'end' in event_body and 'dateTime' in event_body['end']:
-                event_body['end']['dateTime'] = event_body['end']['dateTime'].isoformat()
+            serialize_datetimes(event_body)
             
-            created_event = self.service.events().insert(calendarId='primary', body=event_body).execute()
+            created_event = self._execute(self.service.events().insert(calendarId='primary', body=event_body))
+            self._after_write('primary', event=created_event)
 
-            print(f"Event created: {created_event.get('htmlLink')}")
+            logger.info("Event created: %s", created_event.get('htmlLink'))
             return created_event
         except HttpError as error:
-            print(f"An error occurred: {error}")
+            logger.error("An error occurred: %s", error)
             raise 
 
     def search_events(self, query: str, max_results: int = 5):
         """
         Searches for events in the primary calendar matching the given query string.
+        Identical searches already in flight share one Google request.
         """
+        if self.mirror and self.mirror.is_trusted('primary'):
+            return self.mirror.search('primary', query=query, max_results=max_results)
+
         self._ensure_valid_credentials()
-        
+
+        if self.shared_cache:
+            events = self.shared_cache.search_events('primary', query, max_results, load=self._load_window)
+            if events is not None:
+                return events
+
+        return self._shared_read(('search', 'primary', query, max_results), self._search_events, query, max_results)
+
+    def _search_events(self, query: str, max_results: int):
         try:
             # Get the ZoneInfo object for Central European Time
             cet_tz = ZoneInfo("Europe/Berlin")
             now = datetime.datetime.now(cet_tz).isoformat()
-            events_result = self.service.events().list(
+            events_result = self._execute(self.service.events().list(
                 calendarId='primary', 
                 q=query,
                 timeMin=now,
                 maxResults=max_results,
                 singleEvents=True,
                 orderBy='startTime'
-            ).execute()
+            ))
             events = events_result.get('items', [])
 
-            print(f"Found {len(events)} events matching query '{query}'.")
+            logger.info("Found %s events matching query '%s'.", len(events), query)
             return events
         except HttpError as error:
-            print(f"An error occurred: {error}")
+            logger.error("An error occurred: %s", error)
             raise
-    
+
+    def list_events(self, time_min: datetime.datetime, time_max: datetime.datetime, calendar_id: str = 'primary', max_results: int = 250):
+        """
+        Lists the events of a calendar that overlap the given time window, ordered by start time.
+        """
+        if self.mirror and self.mirror.is_trusted(calendar_id):
+            return self.mirror.search(calendar_id, time_min=time_min, time_max=time_max, max_results=max_results)
+
+        self._ensure_valid_credentials()
+
+        if self.shared_cache:
+            events = self.shared_cache.list_events(calendar_id, time_min, time_max, max_results, load=self._load_window)
+            if events is not None:
+                return events
+
+        key = ('list', calendar_id, time_min.isoformat(), time_max.isoformat(), max_results)
+        return self._shared_read(key, self._list_events, time_min, time_max, calendar_id, max_results)
+
+    def _list_events(self, time_min: datetime.datetime, time_max: datetime.datetime, calendar_id: str, max_results: int):
+        try:
+            events = []
+            params = {
+                'calendarId': calendar_id,
+                'timeMin': time_min.isoformat(),
+                'timeMax': time_max.isoformat(),
+                'maxResults': min(max_results, 250),
+                'singleEvents': True,
+                'orderBy': 'startTime',
+            }
+            while len(events) < max_results:
+                events_result = self._execute(self.service.events().list(**params))
+                events.extend(events_result.get('items', []))
+                page_token = events_result.get('nextPageToken')
+                if not page_token:
+                    break
+                params['pageToken'] = page_token
+
+            logger.info("Listed %s events between %s and %s.", len(events), params['timeMin'], params['timeMax'])
+            return events[:max_results]
+        except HttpError as error:
+            logger.error("An error occurred: %s", error)
+            raise
+
+    def _load_window(self, calendar_id: str, time_min: datetime.datetime, time_max: datetime.datetime):
+        """Loads a whole calendar window for the shared cache (in its background refresh thread)."""
+        with deadline_scope(SHARED_CACHE_LOAD_TIMEOUT):
+            return self._list_events(time_min, time_max, calendar_id, MAX_EVENTS)
+
+    def list_events_page(self, time_min: datetime.datetime, time_max: datetime.datetime, calendar_id: str = 'primary',
+                         page_token: Optional[str] = None, page_size: int = 250):
+        """
+        Fetches one page of the events overlapping a time window, ordered by start time.
+        Returns the raw response including 'items', 'nextPageToken', 'etag' and 'updated'.
+        """
+        self._ensure_valid_credentials()
+
+        try:
+            params = {
+                'calendarId': calendar_id,
+                'timeMin': time_min.isoformat(),
+                'timeMax': time_max.isoformat(),
+                'maxResults': page_size,
+                'singleEvents': True,
+                'orderBy': 'startTime',
+            }
+            if page_token:
+                params['pageToken'] = page_token
+            return self._execute(self.service.events().list(**params))
+        except HttpError as error:
+            logger.error("An error occurred: %s", error)
+            raise
+
+    def get_event(self, event_id: str):
+        """
+        Retrieves a single event from the primary calendar by its event id.
+        """
+        self._ensure_valid_credentials()
+
+        return self._shared_read(('get', 'primary', event_id), self._get_event, event_id)
+
+    def _get_event(self, event_id: str):
+        try:
+            return self._execute(self.service.events().get(calendarId='primary', eventId=event_id))
+        except HttpError as error:
+            logger.error("An error occurred: %s", error)
+            raise
+
+    def cached_event(self, event_id: str, calendar_id: str = 'primary'):
+        """
+        Returns the locally mirrored version of an event, or None if the mirror cannot be trusted.
+        """
+        if self.mirror and self.mirror.is_trusted(calendar_id):
+            return self.mirror.get(calendar_id, event_id)
+        return None
+
     def delete_event(self, event_id: str):
         """
         Deletes an event in the primary calendar matching the given event id.
@@ -154,33 +337,117 @@ class GoogleCalendarService:
         self._ensure_valid_credentials()
         
         try:
-            self.service.events().delete(calendarId='primary', eventId=event_id).execute()
-            print(F"Event deleted: {event_id}")
+            self._execute(self.service.events().delete(calendarId='primary', eventId=event_id))
+            self._after_write('primary', deleted_id=event_id)
+            logger.info("Event deleted: %s", event_id)
             return 
         except HttpError as error:
-            print(f"An error occurred: {error}")
+            logger.error("An error occurred: %s", error)
             raise
     
-    def update_event(self, event_id: str, updated_data: dict[str, Any]):
+    def update_event(self, event_id: str, updated_data: dict[str, Any], etag: Optional[str] = None):
         """
-        Updates an event if the primary calendar matching the given event id.
+        Patches an event in the primary calendar matching the given event id.
+        Only the fields in updated_data are changed. If an ETag is given, the update is
+        conditional and EventConflictError is raised when the event has changed since.
         """
         self._ensure_valid_credentials()
         
         try:
-            event_updates = self.service.events().update(
+            serialize_datetimes(updated_data)
+            patch_request = self.service.events().patch(
                 calendarId ='primary', 
                 eventId = event_id, 
                 body= updated_data
-            ).execute()
+            )
+            if etag:
+                patch_request.headers['If-Match'] = etag
+            event_updates = self._execute(patch_request)
+            self._after_write('primary', event=event_updates)
 
-            print(f"Event updated: {event_updates.get('htmlLink')}")
+            logger.info("Event updated: %s", event_updates.get('htmlLink'))
             return event_updates
         except HttpError as error:
-            print(f"An error occurred: {error}")
+            if error.resp.status == 412:
+                raise EventConflictError(f"Event '{event_id}' was changed by someone else in the meantime.")
+            logger.error("An error occurred: %s", error)
             raise
-    
 
+    def replace_event(self, event_id: str, event_data: dict[str, Any]):
+        """
+        Replaces an event in the primary calendar as a whole, e.g. to restore a snapshot of it.
+        Unlike update_event, fields missing from event_data are removed from the event.
+        """
+        self._ensure_valid_credentials()
+
+        try:
+            body = {key: value for key, value in event_data.items() if key not in READ_ONLY_FIELDS}
+            serialize_datetimes(body)
+            replaced_event = self._execute(self.service.events().update(calendarId='primary', eventId=event_id, body=body))
+            self._after_write('primary', event=replaced_event)
+
+            logger.info("Event replaced: %s", replaced_event.get('htmlLink'))
+            return replaced_event
+        except HttpError as error:
+            logger.error("An error occurred: %s", error)
+            raise
+
+    def list_event_changes(self, calendar_id: str = 'primary', sync_token: Optional[str] = None, time_min: Optional[str] = None):
+        """
+        Lists all events of a calendar, or only the changes since sync_token.
+        Returns the list of (possibly cancelled) events and the next sync token.
+        Raises HttpError with status 410 when the sync token has expired.
+        """
+        self._ensure_valid_credentials()
+
+        params = {'calendarId': calendar_id, 'singleEvents': True, 'maxResults': 250}
+        if sync_token:
+            params['syncToken'] = sync_token
+        elif time_min:
+            params['timeMin'] = time_min
+
+        events = []
+        try:
+            while True:
+                events_result = self._execute(self.service.events().list(**params))
+                events.extend(events_result.get('items', []))
+                page_token = events_result.get('nextPageToken')
+                if not page_token:
+                    return events, events_result.get('nextSyncToken')
+                params['pageToken'] = page_token
+        except HttpError as error:
+            logger.error("An error occurred: %s", error)
+            raise
 
+    def watch_events(self, calendar_id: str, channel_id: str, address: str, token: Optional[str] = None, ttl: Optional[int] = None):
+        """
+        Opens a push notification channel for changes to the events of a calendar.
+        """
+        self._ensure_valid_credentials()
 
+        body = {'id': channel_id, 'type': 'web_hook', 'address': address}
+        if token:
+            body['token'] = token
+        if ttl:
+            body['params'] = {'ttl': str(ttl)}
 
+        try:
+            channel = self._execute(self.service.events().watch(calendarId=calendar_id, body=body))
+            logger.info("Watching calendar '%s' on channel %s", calendar_id, channel_id)
+            return channel
+        except HttpError as error:
+            logger.error("An error occurred: %s", error)
+            raise
+
+    def stop_channel(self, channel_id: str, resource_id: str):
+        """
+        Stops a push notification channel.
+        """
+        self._ensure_valid_credentials()
+
+        try:
+            self._execute(self.service.channels().stop(body={'id': channel_id, 'resourceId': resource_id}))
+            logger.info("Channel stopped: %s", channel_id)
+        except HttpError as error:
+            logger.error("An error occurred: %s", error)
+            raise
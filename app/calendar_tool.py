@@ -1,15 +1,39 @@
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-import os.path
+from dateutil.parser import parse
+from pydantic import ValidationError
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Iterator, Optional
+import argparse
+import csv
 import datetime
+import hashlib
+import json
+import os.path
+import random
+import re
+import threading
+import time
 
 from constants import APP_PATH
+from models import EventCreateRequest
+from event_body import apply_theme_color, serialize_datetimes
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
-def main():
+# Google accepts at most 50 requests per batch
+MAX_BATCH_SIZE = 50
+# Statuses worth retrying: rate limits and transient server errors
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# RFC 5545 durations, e.g. PT1H30M, P1D or P2W
+ICS_DURATION = re.compile(r"^([+-])?P(?:(\d+)W|(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?)$")
+
+
+def load_credentials():
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
@@ -22,25 +46,401 @@ def main():
             creds = flow.run_local_server(port=42409)
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
-    
-    service = build('calendar', 'v3', credentials=creds)
-
-    event = {
-        'summary': 'Test Event from Python',
-        'location': 'Online', 
-        'description': 'Just testing the Gooogle Calendar API', 
-        'start': {
-            'dateTime': (datetime.datetime.utcnow() + datetime.timedelta(minutes=5)).isoformat() + 'Z',
-            'timeZone': 'UTC',
-        },
-        'end': {
-            'dateTime': (datetime.datetime.utcnow() + datetime.timedelta(minutes=35)).isoformat() + 'Z',
-            'timeZone': 'UTC',
-        },
-    }
-
-    event = service.events().insert(calendarId = 'primary', body = event).execute()
-    print('Event created: %s' % (event.get('htmlLink')))
+    return creds
+
+
+# --- Input ---
+
+def _csv_moment(value: str, timezone: str, dayfirst: bool) -> dict[str, Any]:
+    value = value.strip()
+    if ISO_DATE.match(value):
+        return {'date': value}
+    return {'dateTime': parse(value, dayfirst=dayfirst), 'timeZone': timezone}
+
+
+def read_csv(path: str, timezone: str, dayfirst: bool = False) -> Iterator[tuple[int, dict[str, Any], str]]:
+    """
+    Streams events from a CSV file with a header row. Required columns: summary, start, end.
+    Optional: description, location, theme, colorId, timezone, id. Dates without a time are all-day events.
+    Yields (row number, event fields, import key); rows that cannot be parsed carry the error in '_error'.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row_number, row in enumerate(csv.DictReader(f), start=1):
+            row = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+            row_timezone = row.get('timezone') or timezone
+            try:
+                fields = {
+                    'summary': row.get('summary'),
+                    'start': _csv_moment(row.get('start', ''), row_timezone, dayfirst),
+                    'end': _csv_moment(row.get('end', ''), row_timezone, dayfirst),
+                    'description': row.get('description') or None,
+                    'location': row.get('location') or None,
+                    'theme': row.get('theme') or None,
+                    'colorId': row.get('colorid') or None,
+                }
+            except (ValueError, OverflowError) as e:
+                fields = {'_error': f"Unreadable date: {e}"}
+            yield row_number, fields, row.get('id') or f"{row.get('summary')}|{row.get('start')}|{row.get('end')}"
+
+
+def _unescape_text(value: str) -> str:
+    return re.sub(r"\\([\\;,nN])", lambda match: "\n" if match.group(1) in "nN" else match.group(1), value)
+
+
+def _ics_moment(params: dict[str, str], value: str, timezone: str) -> dict[str, Any]:
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return {'date': datetime.datetime.strptime(value, '%Y%m%d').date()}
+    moment = datetime.datetime.strptime(value.rstrip('Z'), '%Y%m%dT%H%M%S')
+    if value.endswith('Z'):
+        return {'dateTime': moment.replace(tzinfo=datetime.timezone.utc), 'timeZone': 'UTC'}
+    return {'dateTime': moment, 'timeZone': params.get('TZID') or timezone}
+
+
+def _ics_duration(value: str) -> datetime.timedelta:
+    value = value.strip().upper()
+    match = ICS_DURATION.match(value)
+    if not match or not any(match.groups()[1:]) or value.endswith('T'):
+        raise ValueError(f"invalid duration '{value}'")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = datetime.timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                                  minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+
+def _ics_lines(f) -> Iterator[str]:
+    """Unfolds content lines (RFC 5545: continuation lines start with a space or tab)."""
+    current = None
+    for line in f:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def read_ics(path: str, timezone: str) -> Iterator[tuple[int, dict[str, Any], str]]:
+    """
+    Streams the VEVENT components of an iCalendar file, one event at a time.
+    Yields (event number, event fields, import key); events that cannot be parsed carry the error in '_error'.
+    """
+    with open(path, encoding='utf-8-sig') as f:
+        number = 0
+        properties = None
+        nested = 0
+        for line in _ics_lines(f):
+            if line == 'BEGIN:VEVENT':
+                properties, nested = [], 0
+            elif properties is None:
+                continue
+            elif line.startswith('BEGIN:'):
+                # Alarms and other sub-components of the event
+                nested += 1
+            elif line.startswith('END:') and nested:
+                nested -= 1
+            elif line == 'END:VEVENT':
+                number += 1
+                yield (number, *_ics_event(properties, timezone))
+                properties = None
+            elif not nested and ':' in line:
+                name_and_params, value = line.split(':', 1)
+                name, *raw_params = name_and_params.split(';')
+                params = dict(param.split('=', 1) for param in raw_params if '=' in param)
+                properties.append((name.upper(), params, value))
+
+
+def _ics_event(properties: list, timezone: str) -> tuple[dict[str, Any], str]:
+    fields, recurrence, uid, recurrence_id, duration = {'summary': None}, [], None, "", None
+    try:
+        for name, params, value in properties:
+            if name in ('SUMMARY', 'DESCRIPTION', 'LOCATION'):
+                fields[name.lower()] = _unescape_text(value)
+            elif name == 'DTSTART':
+                fields['start'] = _ics_moment(params, value, timezone)
+            elif name == 'DTEND':
+                fields['end'] = _ics_moment(params, value, timezone)
+            elif name == 'DURATION':
+                duration = _ics_duration(value)
+            elif name in ('RRULE', 'EXRULE', 'RDATE', 'EXDATE'):
+                recurrence.append(f"{name}{''.join(f';{key}={val}' for key, val in params.items())}:{value}")
+            elif name == 'UID':
+                uid = value
+            elif name == 'RECURRENCE-ID':
+                recurrence_id = value
+    except ValueError as e:
+        return {'_error': f"Unreadable date: {e}"}, uid or ""
+
+    start = fields.get('start', {})
+    if 'end' not in fields and duration is not None and start.get('dateTime'):
+        fields['end'] = {'dateTime': start['dateTime'] + duration, 'timeZone': start['timeZone']}
+    elif 'end' not in fields and duration is not None and start.get('date'):
+        fields['end'] = {'date': start['date'] + datetime.timedelta(days=duration.days)}
+    elif 'end' not in fields and start.get('date'):
+        # All-day events without DTEND or DURATION last one day
+        fields['end'] = {'date': fields['start']['date'] + datetime.timedelta(days=1)}
+    if recurrence:
+        fields['recurrence'] = recurrence
+    key = f"{uid}|{recurrence_id}" if uid else f"{fields.get('summary')}|{fields.get('start')}|{fields.get('end')}"
+    return fields, key
+
+
+def event_id_for(calendar_id: str, key: str) -> str:
+    """Deterministic event id, so that importing the same row twice is detected by Google (409)."""
+    # Google event ids use base32hex characters (a-v, 0-9), which include all hex digits
+    return "bb" + hashlib.sha1(f"{calendar_id}|{key}".encode('utf-8')).hexdigest()
+
+
+def validate(fields: dict[str, Any]) -> dict[str, Any]:
+    """Validates the fields of an event through EventCreateRequest and returns the insert body."""
+    if '_error' in fields:
+        raise ValueError(fields['_error'])
+    event_model = EventCreateRequest(**fields)
+    body = event_model.model_dump(by_alias=True, exclude_none=True)
+    apply_theme_color(body, event_model.theme)
+    serialize_datetimes(body)
+    return body
+
+
+# --- Writing ---
+
+class RateLimiter:
+    """Token bucket shared by all import threads; acquire(n) blocks until n requests may be sent."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, count: int = 1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # A batch larger than the bucket may start once the bucket is full
+                self.tokens = min(max(self.rate, count), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait_time = (count - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def _is_retryable(error: HttpError) -> bool:
+    # Google reports exceeded quotas as 403 rateLimitExceeded / userRateLimitExceeded
+    return error.resp.status in RETRYABLE_STATUSES or \
+        (error.resp.status == 403 and b'ateLimitExceeded' in (error.content or b''))
+
+
+class BatchInserter:
+    """
+    Inserts batches of events with Google batch requests. Every thread gets its own service
+    (httplib2 connections must not be shared between threads). Rate-limited and transiently
+    failed inserts are retried with exponential backoff; events that already exist count as done.
+    """
+
+    def __init__(self, creds, calendar_id: str, limiter: RateLimiter, max_retries: int = 5):
+        self.creds = creds
+        self.calendar_id = calendar_id
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self._local = threading.local()
+
+    def _service(self):
+        if not hasattr(self._local, 'service'):
+            self._local.service = build('calendar', 'v3', credentials=self.creds, cache_discovery=False)
+        return self._local.service
+
+    def insert(self, batch: list[tuple[int, dict[str, Any]]]) -> dict[str, Any]:
+        """Inserts (row number, body) pairs; returns the counts and the rows that failed for good."""
+        service = self._service()
+        pending = {str(row_number): body for row_number, body in batch}
+        result = {"imported": 0, "existing": 0, "failed": []}
+
+        for attempt in range(self.max_retries + 1):
+            retry = {}
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    result["imported"] += 1
+                elif isinstance(exception, HttpError) and exception.resp.status == 409:
+                    result["existing"] += 1
+                elif isinstance(exception, HttpError) and _is_retryable(exception):
+                    retry[request_id] = pending[request_id]
+                else:
+                    result["failed"].append({"row": int(request_id), "error": str(exception)})
+
+            self.limiter.acquire(len(pending))
+            batch_request = service.new_batch_http_request(callback=callback)
+            for request_id, body in pending.items():
+                batch_request.add(service.events().insert(calendarId=self.calendar_id, body=body), request_id=request_id)
+            try:
+                batch_request.execute()
+            except (HttpError, OSError) as e:
+                # The whole batch failed in transit, none of its callbacks ran
+                retry = dict(pending)
+                error = e
+            else:
+                error = None
+
+            if not retry:
+                return result
+            pending = retry
+            if attempt < self.max_retries:
+                time.sleep(min(30, 2 ** attempt) + random.random())
+
+        result["failed"].extend({"row": int(request_id), "error": str(error or "Rate limited too often.")}
+                                for request_id in pending)
+        return result
+
+
+# --- Progress ---
+
+class Checkpoint:
+    """
+    Resumable progress of an import, saved atomically after every batch. Batches finish out of
+    order, so only the rows before the first unfinished batch count as done, and the results of a
+    batch are only added once all batches before it have finished too. Rows after that are sent
+    again on resume (and reported as already existing thanks to their deterministic ids), but
+    counted only once.
+    """
+
+    def __init__(self, path: str, source: str, calendar_id: str):
+        self.path = path
+        self.state = {"source": source, "calendar_id": calendar_id, "next_row": 1,
+                      "imported": 0, "existing": 0, "invalid": 0, "failed": []}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get("source") == source and saved.get("calendar_id") == calendar_id:
+                self.state = saved
+        self._finished = {}  # batch index -> (last row, result) of batches waiting for earlier ones
+        self._first_open = 0
+
+    @property
+    def next_row(self) -> int:
+        return self.state["next_row"]
+
+    def record(self, batch_index: int, last_row: int, result: dict[str, Any]):
+        self._finished[batch_index] = (last_row, result)
+        while self._first_open in self._finished:
+            last_row, result = self._finished.pop(self._first_open)
+            for key in ("imported", "existing", "invalid"):
+                self.state[key] += result.get(key, 0)
+            self.state["failed"].extend(result.get("failed", []))
+            self.state["next_row"] = max(self.state["next_row"], last_row + 1)
+            self._first_open += 1
+        self.save()
+
+    def save(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(temporary, self.path)
+
+
+def iter_batches(rows, calendar_id: str, start_row: int, batch_size: int):
+    """Groups valid rows into batches; yields (batch, last row number, invalid rows)."""
+    batch, invalid, last_row = [], [], start_row - 1
+    for row_number, fields, key in rows:
+        if row_number < start_row:
+            continue
+        last_row = row_number
+        try:
+            body = validate(fields)
+        except (ValidationError, ValueError) as e:
+            invalid.append({"row": row_number, "error": str(e)})
+        else:
+            body['id'] = event_id_for(calendar_id, key)
+            batch.append((row_number, body))
+        if len(batch) >= batch_size:
+            yield batch, last_row, invalid
+            batch, invalid = [], []
+    if batch or invalid:
+        yield batch, last_row, invalid
+
+
+def import_events(path: str, calendar_id: str = 'primary', timezone: str = "Europe/Berlin", file_format: Optional[str] = None,
+                  workers: int = 4, batch_size: int = 25, rate: float = 8.0, checkpoint_path: Optional[str] = None,
+                  dayfirst: bool = False, dry_run: bool = False) -> dict[str, Any]:
+    """Imports the events of an ICS or CSV file into a calendar and returns the final counts."""
+    file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'ics')
+    rows = read_csv(path, timezone, dayfirst) if file_format == 'csv' else read_ics(path, timezone)
+    checkpoint = Checkpoint(checkpoint_path or f"{path}.checkpoint.json", os.path.abspath(path), calendar_id)
+    if checkpoint.next_row > 1:
+        print(f"Resuming at row {checkpoint.next_row}.")
+
+    batch_size = min(batch_size, MAX_BATCH_SIZE)
+    batches = iter_batches(rows, calendar_id, checkpoint.next_row, batch_size)
+    started = time.monotonic()
+    done_before = checkpoint.state["imported"] + checkpoint.state["existing"]
+
+    def report():
+        elapsed = time.monotonic() - started
+        done = checkpoint.state["imported"] + checkpoint.state["existing"] - done_before
+        print(f"{checkpoint.state['imported']} imported, {checkpoint.state['existing']} already there, "
+              f"{checkpoint.state['invalid']} invalid, {len(checkpoint.state['failed'])} failed "
+              f"- {done / elapsed if elapsed else 0.0:.1f} events/s")
+
+    if dry_run:
+        for batch_index, (batch, last_row, invalid) in enumerate(batches):
+            for failure in invalid:
+                print(f"Row {failure['row']}: {failure['error']}")
+            print(f"Rows up to {last_row}: {len(batch)} valid, {len(invalid)} invalid.")
+        return checkpoint.state
+
+    inserter = BatchInserter(load_credentials(), calendar_id, RateLimiter(rate))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="calendar-import") as pool:
+        in_flight = {}
+
+        def collect(futures):
+            for future in futures:
+                batch_index, last_row, invalid = in_flight.pop(future)
+                result = future.result()
+                result["invalid"] = len(invalid)
+                result["failed"] = invalid + result["failed"]
+                checkpoint.record(batch_index, last_row, result)
+            report()
+
+        for batch_index, (batch, last_row, invalid) in enumerate(batches):
+            # Keep reading the input only as fast as the inserts go
+            if not batch:
+                checkpoint.record(batch_index, last_row, {"invalid": len(invalid), "failed": invalid})
+                continue
+            while len(in_flight) >= workers * 2:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            in_flight[pool.submit(inserter.insert, batch)] = (batch_index, last_row, invalid)
+        while in_flight:
+            collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+
+    elapsed = time.monotonic() - started
+    done = checkpoint.state["imported"] + checkpoint.state["existing"] - done_before
+    print(f"Done in {elapsed:.1f}s ({done / elapsed if elapsed else 0.0:.1f} events/s). Checkpoint: {checkpoint.path}")
+    for failure in checkpoint.state["failed"]:
+        print(f"Row {failure['row']}: {failure['error']}")
+    return checkpoint.state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import events from an ICS or CSV file into Google Calendar.")
+    parser.add_argument('path', help="ICS or CSV file (CSV columns: summary, start, end, and optionally description, location, theme, colorId, timezone, id)")
+    parser.add_argument('--calendar', default='primary', help="Target calendar id (default: primary)")
+    parser.add_argument('--timezone', default="Europe/Berlin", help="Timezone of times without one (default: Europe/Berlin)")
+    parser.add_argument('--format', choices=('ics', 'csv'), help="Input format (default: from the file extension)")
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent batch requests (default: 4)")
+    parser.add_argument('--batch-size', type=int, default=25, help=f"Events per batch request, at most {MAX_BATCH_SIZE} (default: 25)")
+    parser.add_argument('--rate', type=float, default=8.0, help="Inserts per second across all workers (default: 8)")
+    parser.add_argument('--checkpoint', help="Progress file for resuming (default: <path>.checkpoint.json)")
+    parser.add_argument('--dayfirst', action='store_true', help="Read CSV dates like 03.04.2025 as day first")
+    parser.add_argument('--dry-run', action='store_true', help="Only validate the input")
+    args = parser.parse_args()
+
+    import_events(args.path, calendar_id=args.calendar, timezone=args.timezone, file_format=args.format,
+                  workers=args.workers, batch_size=args.batch_size, rate=args.rate, checkpoint_path=args.checkpoint,
+                  dayfirst=args.dayfirst, dry_run=args.dry_run)
 
 if __name__ == '__main__':
     main()
@@ -1,4 +1,7 @@
 from pathlib import Path
 
 APP_PATH = Path(__file__).parent
-REPO_PATH = APP_PATH.parent
\ No newline at end of file
+REPO_PATH = APP_PATH.parent
+
+# Upper bound on events loaded for one calendar window
+MAX_EVENTS = 5000
\ No newline at end of file
@@ -1,5 +1,10 @@
 from calendar_service import GoogleCalendarService
+from write_queue import WriteBehindCalendar
+from prefetch import CalendarPrefetcher
 import os
+from logger import get_logger
+
+logger = get_logger(__name__)
 
 
 class AppContext:
@@ -8,9 +13,32 @@ class AppContext:
         Initializes the application context by creating instances of all necessary services.
         Calendar service will initialize even without authentication - user can authenticate later via /google/login.
         """
+        self.write_queue = None
+        self.prefetcher = None
         try: 
             self.calendar_service = GoogleCalendarService()
-            print('Context initialized successfully.')
+            # Optional event cache shared by all worker processes on this host
+            shared_cache_dir = os.getenv('BILLABEE_SHARED_CACHE_DIR')
+            if shared_cache_dir:
+                # Imported here because the cache relies on fcntl, which is only available on Unix
+                from shared_cache import SharedEventCache
+                self.calendar_service.shared_cache = SharedEventCache(
+                    shared_cache_dir,
+                    days=int(os.getenv('BILLABEE_SHARED_CACHE_DAYS', '14')),
+                    ttl=float(os.getenv('BILLABEE_SHARED_CACHE_TTL', '60'))
+                )
+                logger.info("Shared event cache enabled in %s.", shared_cache_dir)
+            # Optional write-behind queue: mutations are acknowledged locally and flushed in the background
+            if os.getenv('BILLABEE_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes'):
+                flush_delay = float(os.getenv('BILLABEE_WRITE_BEHIND_DELAY', '2.0'))
+                self.write_queue = WriteBehindCalendar(self.calendar_service, flush_delay=flush_delay)
+                self.calendar_service = self.write_queue
+                logger.info("Write-behind calendar queue enabled (flush delay %ss).", flush_delay)
+            # Speculative prefetch of the next days, overlapping Google latency with the LLM calls
+            prefetch_days = int(os.getenv('BILLABEE_PREFETCH_DAYS', '3'))
+            if prefetch_days > 0:
+                self.prefetcher = CalendarPrefetcher(self.calendar_service, days=prefetch_days)
+            logger.info("Context initialized successfully.")
         except Exception as e:
-            print(f"WARNING: Could not initialize Google Calendar service: {e}")
+            logger.warning("Could not initialize Google Calendar service: %s", e)
             self.calendar_service = None
\ No newline at end of file
@@ -0,0 +1,50 @@
+from typing import Callable
+
+# Rough average for English chat text with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# After folding, the verbatim history is brought down to this share of the budget,
+# so the summary is not updated on every single call
+FOLD_TARGET = 0.75
+
+
+def estimate_tokens(messages: list[dict]) -> int:
+    """Estimates the number of tokens a list of chat messages will use."""
+    return sum(len(message.get("content") or "") // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def truncate_summary(summary: str, messages: list[dict], max_tokens: int) -> str:
+    """Fallback summary without an LLM: appends the folded messages and keeps the most recent part."""
+    lines = [summary] if summary else []
+    lines += [f"{message['role']}: {message.get('content') or ''}" for message in messages]
+    text = "\n".join(lines)
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    return text[-max_chars:] if len(text) > max_chars else text
+
+
+def fit_history(history: list[dict], summary: str, budget: int,
+                summarize: Callable[[str, list[dict]], str]) -> tuple[list[dict], str]:
+    """
+    Keeps the chat history within a token budget.
+    Recent messages stay verbatim; the oldest ones are folded into the rolling summary
+    by summarize(previous_summary, folded_messages). Returns the new history and summary.
+    """
+    tokens = estimate_tokens(history)
+    if tokens <= budget:
+        return history, summary
+
+    target = int(budget * FOLD_TARGET)
+    cut = 0
+    # Always keep the latest message verbatim
+    while cut < len(history) - 1 and tokens > target:
+        tokens -= estimate_tokens([history[cut]])
+        cut += 1
+    # Start the verbatim part at a user message so an exchange is not torn apart
+    while cut < len(history) - 1 and history[cut]["role"] != "user":
+        cut += 1
+
+    if cut == 0:
+        # Only the latest message is left, there is nothing to fold
+        return history, summary
+    return history[cut:], summarize(summary, history[:cut])
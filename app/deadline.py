@@ -0,0 +1,79 @@
+import contextvars
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Below this many seconds an upstream call is not worth starting
+MIN_CALL_TIMEOUT = 0.5
+
+_current = contextvars.ContextVar('deadline', default=None)
+_exceeded = Counter()
+_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request's time budget is spent. stage names where it happened."""
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during {stage}.")
+        self.stage = stage
+
+
+class Deadline:
+    """A point in time by which the current request has to be answered."""
+
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= MIN_CALL_TIMEOUT
+
+    def timeout(self, stage: str, cap: Optional[float] = None) -> float:
+        """Timeout for the next upstream call; raises DeadlineExceeded if too little time is left."""
+        if self.expired():
+            raise exceeded(stage)
+        remaining = self.remaining()
+        return min(remaining, cap) if cap else remaining
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """Runs the block with a deadline that upstream calls made from this context pick up."""
+    deadline = Deadline(seconds)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def call_timeout(stage: str, cap: Optional[float] = None) -> Optional[float]:
+    """Timeout for an upstream call in the current context, or None if no deadline is set."""
+    deadline = _current.get()
+    return None if deadline is None else deadline.timeout(stage, cap)
+
+
+def exceeded(stage: str) -> DeadlineExceeded:
+    """Records a deadline miss for the stage and returns the exception to raise."""
+    with _lock:
+        _exceeded[stage] += 1
+    logger.warning("Deadline exceeded during %s", stage)
+    return DeadlineExceeded(stage)
+
+
+def deadline_stats() -> dict:
+    with _lock:
+        return dict(_exceeded)
@@ -0,0 +1,33 @@
+import datetime
+from typing import Any
+
+# Map high-level themes to Google Calendar colorId 
+THEME_COLOR_MAP: dict[str, str] = {
+    "Work": "#AF6C34",    
+    "Study": "#C6A868",       
+    "Exercise": "#87A390", 
+    "Wellbeing": "#87A390",  
+    "Quality Time": "#BE2E46",     
+    "Social": "#957367",     
+    "Errand": "#7F803E",     
+    "Bachelor Thesis": "#BA9504",      
+}
+
+
+def apply_theme_color(event_body: dict, theme: str | None):
+    """Sets the event's color from its theme, unless a color was given explicitly."""
+    if not theme:
+        return
+    color = THEME_COLOR_MAP.get(theme.strip().title())
+    if color and 'colorId' not in event_body:
+        event_body['colorId'] = color
+
+
+def serialize_datetimes(event_body: dict[str, Any]):
+    """Converts start/end datetimes of an event body to RFC3339 strings in place."""
+    for key in ('start', 'end'):
+        value = event_body.get(key)
+        if value and isinstance(value.get('dateTime'), datetime.datetime):
+            value['dateTime'] = value['dateTime'].isoformat()
+        if value and isinstance(value.get('date'), datetime.date):
+            value['date'] = value['date'].isoformat()
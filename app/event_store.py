@@ -0,0 +1,232 @@
+import datetime
+import json
+import sys
+import time
+import tracemalloc
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Optional
+from zoneinfo import ZoneInfo
+
+from models import GoogleCalendarEvent
+
+NO_VALUE = -1
+
+
+def event_bounds(event: dict[str, Any]):
+    """Returns the start and end of an event as timezone-aware datetimes (all-day events start at midnight)."""
+    bounds = []
+    for key in ('start', 'end'):
+        value = event.get(key) or {}
+        if value.get('dateTime'):
+            moment = value['dateTime']
+            if isinstance(moment, str):
+                moment = datetime.datetime.fromisoformat(moment)
+        else:
+            day = value.get('date')
+            if isinstance(day, str):
+                day = datetime.date.fromisoformat(day)
+            moment = datetime.datetime.combine(day, datetime.time())
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=ZoneInfo(value.get('timeZone') or "Europe/Berlin"))
+        bounds.append(moment)
+    return bounds[0], bounds[1]
+
+
+def _json_default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class EventStore:
+    """
+    Compact, columnar store for many calendar events.
+
+    The fields needed to answer time queries live in parallel arrays sorted by start
+    (start/end as epoch seconds, interned summary/calendar/color ids). Everything else is
+    kept as a JSON blob per event and only decoded when an event is materialized.
+    Window and overlap queries use bisect on the start column and are O(log n + k).
+    The store is not thread-safe; callers hold their own lock.
+    """
+
+    def __init__(self):
+        self._starts = array('d')
+        self._ends = array('d')
+        self._summary_ids = array('l')
+        self._calendar_ids = array('l')
+        self._color_ids = array('l')
+        self._ids = []
+        self._blobs = []
+        self._strings = []
+        self._string_ids = {}
+        self._start_by_id = {}
+        # Longest event seen; bounds how far back a window query has to look
+        self._max_duration = 0.0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, event_id):
+        return event_id in self._start_by_id
+
+    def add(self, event: dict[str, Any], calendar_id: str = 'primary'):
+        """Adds an event (as returned by the Google API), replacing an event with the same id."""
+        event_id = event['id']
+        self.remove(event_id)
+
+        start, end = (moment.timestamp() for moment in event_bounds(event))
+        cold = {key: value for key, value in event.items() if key not in ('id', 'summary', 'colorId')}
+
+        index = bisect_right(self._starts, start)
+        self._starts.insert(index, start)
+        self._ends.insert(index, end)
+        self._summary_ids.insert(index, self._intern(event.get('summary')))
+        self._calendar_ids.insert(index, self._intern(calendar_id))
+        self._color_ids.insert(index, self._intern(event.get('colorId')))
+        self._ids.insert(index, event_id)
+        self._blobs.insert(index, json.dumps(cold, separators=(',', ':'), default=_json_default).encode())
+        self._start_by_id[event_id] = start
+        self._max_duration = max(self._max_duration, end - start)
+
+    def remove(self, event_id: str) -> bool:
+        """Removes an event by id. Returns False if it was not stored."""
+        start = self._start_by_id.pop(event_id, None)
+        if start is None:
+            return False
+        index = bisect_left(self._starts, start)
+        while self._ids[index] != event_id:
+            index += 1
+        for column in (self._starts, self._ends, self._summary_ids, self._calendar_ids,
+                       self._color_ids, self._ids, self._blobs):
+            del column[index]
+        return True
+
+    def window(self, time_min: datetime.datetime, time_max: Optional[datetime.datetime] = None):
+        """Yields the positions of events overlapping [time_min, time_max), ordered by start."""
+        lower = time_min.timestamp()
+        low = bisect_left(self._starts, lower - self._max_duration)
+        high = len(self._starts) if time_max is None else bisect_left(self._starts, time_max.timestamp())
+        for index in range(low, high):
+            if self._ends[index] > lower:
+                yield index
+
+    def overlaps(self, start: datetime.datetime, end: datetime.datetime, exclude_id: Optional[str] = None) -> bool:
+        """True if any stored event overlaps [start, end)."""
+        return any(self._ids[index] != exclude_id for index in self.window(start, end))
+
+    def search(self, query: str = "", time_min: Optional[datetime.datetime] = None,
+               time_max: Optional[datetime.datetime] = None, max_results: Optional[int] = None,
+               calendar_id: Optional[str] = None):
+        """Searches events like events().list(q=..., timeMin=..., timeMax=..., orderBy='startTime') would."""
+        time_min = time_min or datetime.datetime.now(ZoneInfo("Europe/Berlin"))
+        query = (query or "").lower()
+        calendar = self._string_ids.get(calendar_id, NO_VALUE - 1) if calendar_id else None
+
+        results = []
+        for index in self.window(time_min, time_max):
+            if calendar is not None and self._calendar_ids[index] != calendar:
+                continue
+            if query and not self._matches(index, query):
+                continue
+            results.append(self._materialize(index))
+            if max_results and len(results) >= max_results:
+                break
+        return results
+
+    def get(self, event_id: str) -> Optional[dict[str, Any]]:
+        """Returns an event as a dictionary in Google API format."""
+        index = self._position(event_id)
+        return None if index is None else self._materialize(index)
+
+    def get_model(self, event_id: str) -> Optional[GoogleCalendarEvent]:
+        """Returns an event as a full GoogleCalendarEvent model."""
+        event = self.get(event_id)
+        return None if event is None else GoogleCalendarEvent(**event)
+
+    def _intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_VALUE
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self._strings)
+            self._strings.append(sys.intern(value))
+        return string_id
+
+    def _string(self, string_id: int) -> Optional[str]:
+        return None if string_id == NO_VALUE else self._strings[string_id]
+
+    def _position(self, event_id: str) -> Optional[int]:
+        start = self._start_by_id.get(event_id)
+        if start is None:
+            return None
+        index = bisect_left(self._starts, start)
+        while self._ids[index] != event_id:
+            index += 1
+        return index
+
+    def _matches(self, index: int, query: str) -> bool:
+        if query in (self._string(self._summary_ids[index]) or "").lower():
+            return True
+        cold = json.loads(self._blobs[index])
+        return any(query in (cold.get(key) or "").lower() for key in ('description', 'location'))
+
+    def _materialize(self, index: int) -> dict[str, Any]:
+        event = json.loads(self._blobs[index])
+        event['id'] = self._ids[index]
+        summary = self._string(self._summary_ids[index])
+        if summary is not None:
+            event['summary'] = summary
+        color = self._string(self._color_ids[index])
+        if color is not None:
+            event['colorId'] = color
+        return event
+
+
+def benchmark(count: int = 20000, queries: int = 1000):
+    """Compares memory and window query throughput of EventStore with a list of GoogleCalendarEvent models."""
+    base = datetime.datetime(2025, 1, 1, tzinfo=ZoneInfo("Europe/Berlin"))
+    raw_events = []
+    for i in range(count):
+        start = base + datetime.timedelta(minutes=90 * i)
+        raw_events.append({
+            'id': f"event{i:08d}",
+            'status': 'confirmed',
+            'summary': ["Thesis Work", "Workout", "Meditation", "Team Sync", "Groceries"][i % 5],
+            'description': "Generated for the benchmark",
+            'colorId': str(i % 11 + 1),
+            'start': {'dateTime': start.isoformat(), 'timeZone': "Europe/Berlin"},
+            'end': {'dateTime': (start + datetime.timedelta(minutes=60)).isoformat(), 'timeZone': "Europe/Berlin"},
+        })
+    windows = [base + datetime.timedelta(hours=(i * 37) % (count * 3 // 2)) for i in range(queries)]
+
+    tracemalloc.start()
+    models = [GoogleCalendarEvent(**event) for event in raw_events]
+    models_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    store = EventStore()
+    for event in raw_events:
+        store.add(event)
+    store_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for time_min in windows:
+        time_max = time_min + datetime.timedelta(days=1)
+        [model for model in models if model.start.dateTime < time_max and model.end.dateTime > time_min]
+    models_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for time_min in windows:
+        store.search(time_min=time_min, time_max=time_min + datetime.timedelta(days=1))
+    store_seconds = time.perf_counter() - started
+
+    print(f"{count} events, {queries} one-day window queries")
+    print(f"List of models: {models_bytes / 1e6:8.1f} MB, {queries / models_seconds:10.0f} queries/s")
+    print(f"EventStore:     {store_bytes / 1e6:8.1f} MB, {queries / store_seconds:10.0f} queries/s")
+
+
+if __name__ == '__main__':
+    benchmark(*(int(arg) for arg in sys.argv[1:3]))
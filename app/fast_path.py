@@ -0,0 +1,139 @@
+import datetime
+import re
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from dateutil import parser as date_parser
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Ways of asking for the events of a day, after normalization (lowercase, no punctuation, "what's" -> "what is")
+READ_PREFIXES = (
+    "what is on my calendar", "what is on my schedule", "what is on my agenda", "what is on",
+    "what is planned", "what is scheduled", "what is happening",
+    "what do i have planned", "what do i have scheduled", "what do i have on", "what do i have",
+    "what have i got planned", "what have i got on", "what have i got",
+    "do i have anything planned", "do i have anything scheduled", "do i have anything on", "do i have anything",
+    "show me my calendar", "show me my schedule", "show me my agenda", "show my calendar", "show my schedule",
+    "show my agenda", "list my events", "my calendar", "my schedule", "my agenda",
+)
+CONNECTORS = ("for", "on", "this")
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+MONTHS = ("january", "february", "march", "april", "may", "june", "july", "august", "september",
+          "october", "november", "december", "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep",
+          "sept", "oct", "nov", "dec")
+# Explicit dates the parser resolves without guessing: ISO dates or a day number with a month name
+# ("3rd of march", "march 3 2026"); a month name alone is left to the assistant
+EXPLICIT_DATE = re.compile(r"^(\d{4}-\d{2}-\d{2}|\d{1,2}(st|nd|rd|th)? (of )?(%s)( \d{4})?|(%s) \d{1,2}(st|nd|rd|th)?( \d{4})?)$"
+                           % ("|".join(MONTHS), "|".join(MONTHS)))
+
+
+def _normalize(message: str) -> str:
+    text = message.strip().lower().replace("’", "'")
+    text = re.sub(r"\bwhat'?s\b", "what is", text)
+    text = re.sub(r"[?!.,]+", " ", text)
+    text = re.sub(r"\b(please|billa|hey|hi)\b", " ", text)
+    return " ".join(text.split())
+
+
+def _day_range(day: datetime.date, tz: ZoneInfo, days: int = 1):
+    start = datetime.datetime.combine(day, datetime.time(), tzinfo=tz)
+    return start, start + datetime.timedelta(days=days)
+
+
+def _resolve_period(period: str, today: datetime.date, tz: ZoneInfo) -> Optional[dict]:
+    """Turns the day expression of a read request into a time window, or None if it is not clear-cut."""
+    if period in ("today", "today so far", "for today"):
+        time_min, time_max = _day_range(today, tz)
+        return {"time_min": time_min, "time_max": time_max, "label": "today"}
+    if period == "tomorrow":
+        time_min, time_max = _day_range(today + datetime.timedelta(days=1), tz)
+        return {"time_min": time_min, "time_max": time_max, "label": "tomorrow"}
+    if period == "the day after tomorrow":
+        time_min, time_max = _day_range(today + datetime.timedelta(days=2), tz)
+        return {"time_min": time_min, "time_max": time_max, "label": "the day after tomorrow"}
+    if period in ("week", "the week", "the rest of the week"):
+        # Today until the end of Sunday
+        time_min, time_max = _day_range(today, tz, days=7 - today.weekday())
+        return {"time_min": time_min, "time_max": time_max, "label": "this week"}
+    if period == "next week":
+        monday = today + datetime.timedelta(days=7 - today.weekday())
+        time_min, time_max = _day_range(monday, tz, days=7)
+        return {"time_min": time_min, "time_max": time_max, "label": "next week"}
+    if period in WEEKDAYS:
+        # The coming occurrence of that weekday, today included
+        day = today + datetime.timedelta(days=(WEEKDAYS.index(period) - today.weekday()) % 7)
+        time_min, time_max = _day_range(day, tz)
+        return {"time_min": time_min, "time_max": time_max, "label": "today" if day == today else f"on {period.title()}"}
+    if EXPLICIT_DATE.match(period):
+        try:
+            day = date_parser.parse(period, default=datetime.datetime.combine(today, datetime.time())).date()
+            if day < today and not re.search(r"\d{4}", period):
+                # Without a year, "march 3" means the next march 3rd, not the one that has passed
+                day = day.replace(year=today.year + 1)
+        except (ValueError, OverflowError):
+            return None
+        time_min, time_max = _day_range(day, tz)
+        return {"time_min": time_min, "time_max": time_max, "label": f"on {day.strftime('%A, %d %B')}"}
+    return None
+
+
+def recognize_read_intent(message: str, timezone: Optional[str] = None, now: Optional[datetime.datetime] = None) -> Optional[dict]:
+    """
+    Recognizes simple agenda reads such as "what's on my calendar tomorrow" or "what do I have Friday".
+    Returns {"time_min", "time_max", "label"} in the user's timezone, or None whenever the message is
+    anything else, so that it is left to the assistant.
+    """
+    if not message or len(message) > 120:
+        return None
+    text = _normalize(message)
+
+    prefix = next((prefix for prefix in READ_PREFIXES if text == prefix or text.startswith(prefix + " ")), None)
+    if prefix is None:
+        return None
+    period = text[len(prefix):].strip()
+    words = period.split()
+    while words and words[0] in CONNECTORS and len(words) > 1:
+        words = words[1:]
+    period = " ".join(words)
+    if not period:
+        return None
+
+    try:
+        tz = ZoneInfo(timezone or "Europe/Berlin")
+    except Exception:
+        tz = ZoneInfo("Europe/Berlin")
+    today = (now.astimezone(tz) if now else datetime.datetime.now(tz)).date()
+    return _resolve_period(period, today, tz)
+
+
+def _format_time(event, tz: ZoneInfo, multi_day: bool) -> str:
+    if event.start.dateTime is None:
+        day = event.start.date.strftime('%a %d %b ') if multi_day and event.start.date else ""
+        return f"{day}all day"
+    start = event.start.dateTime if event.start.dateTime.tzinfo else event.start.dateTime.replace(tzinfo=tz)
+    start = start.astimezone(tz)
+    text = start.strftime('%a %d %b %H:%M' if multi_day else '%H:%M')
+    if event.end and event.end.dateTime:
+        end = event.end.dateTime if event.end.dateTime.tzinfo else event.end.dateTime.replace(tzinfo=tz)
+        text += f"–{end.astimezone(tz).strftime('%H:%M')}"
+    return text
+
+
+def render_agenda(events: list, intent: dict) -> str:
+    """Templated answer listing the events found for a recognized read intent."""
+    tz = intent["time_min"].tzinfo
+    multi_day = intent["time_max"] - intent["time_min"] > datetime.timedelta(days=1)
+    events = [event for event in events if event.status != 'cancelled' and event.start]
+    if not events:
+        return f"Your calendar is free {intent['label']}, honey. Nothing planned yet!"
+
+    lines = [f"Here is what you have {intent['label']}:"]
+    for event in events:
+        line = f"- {_format_time(event, tz, multi_day)}: {event.summary or '(no title)'}"
+        if event.location:
+            line += f" ({event.location})"
+        lines.append(line)
+    return "\n".join(lines)
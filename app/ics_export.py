@@ -0,0 +1,141 @@
+import datetime
+import hashlib
+from typing import Any, Iterator, Optional
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+PRODUCT_ID = "-//BillaBee//Calendar Export//EN"
+# RFC 5545: lines are folded after 75 octets
+MAX_LINE_OCTETS = 75
+
+
+def fold_line(line: str) -> str:
+    """Folds a content line into CRLF-terminated chunks of at most 75 octets without splitting UTF-8 characters."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= MAX_LINE_OCTETS:
+        return line + "\r\n"
+
+    chunks = []
+    limit = MAX_LINE_OCTETS
+    while encoded:
+        cut = min(limit, len(encoded))
+        # Do not cut inside a multi-byte character
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        chunks.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        # Continuation lines start with a space, which counts towards the limit
+        limit = MAX_LINE_OCTETS - 1
+    return "\r\n ".join(chunks) + "\r\n"
+
+
+def escape_text(value: str) -> str:
+    """Escapes a TEXT property value."""
+    return (value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+                 .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _utc_stamp(value: str) -> str:
+    moment = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _date_property(name: str, value: dict[str, Any]) -> str:
+    if value.get('dateTime'):
+        return f"{name}:{_utc_stamp(value['dateTime'])}"
+    return f"{name};VALUE=DATE:{value['date'].replace('-', '')}"
+
+
+def format_event(event: dict[str, Any]) -> str:
+    """Renders a Google Calendar event as a VEVENT component."""
+    stamp = _utc_stamp(event.get('updated') or event.get('created') or datetime.datetime.now(datetime.timezone.utc).isoformat())
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{event.get('iCalUID') or event['id'] + '@google.com'}",
+        f"DTSTAMP:{stamp}",
+        _date_property("DTSTART", event['start']),
+    ]
+    if event.get('originalStartTime'):
+        # Instances of a recurring event share the series' UID and are told apart by their original start
+        lines.append(_date_property("RECURRENCE-ID", event['originalStartTime']))
+    if event.get('end'):
+        lines.append(_date_property("DTEND", event['end']))
+    for key, name in (('summary', 'SUMMARY'), ('description', 'DESCRIPTION'), ('location', 'LOCATION')):
+        if event.get(key):
+            lines.append(f"{name}:{escape_text(event[key])}")
+    if event.get('status'):
+        lines.append(f"STATUS:{event['status'].upper()}")
+    if event.get('created'):
+        lines.append(f"CREATED:{_utc_stamp(event['created'])}")
+    if event.get('updated'):
+        lines.append(f"LAST-MODIFIED:{stamp}")
+    if event.get('htmlLink'):
+        lines.append(f"URL:{event['htmlLink']}")
+    lines.append("END:VEVENT")
+    return "".join(fold_line(line) for line in lines)
+
+
+class CalendarExport:
+    """
+    Streams the events of one or more calendars in a date range as an iCalendar file.
+    The first page of every calendar is fetched up front to derive the ETag and Last-Modified
+    validators; the remaining pages are fetched while streaming, one at a time.
+    """
+
+    def __init__(self, calendar_service, calendar_ids: list[str], time_min: datetime.datetime,
+                 time_max: datetime.datetime, page_size: int = 250):
+        self.calendar_service = calendar_service
+        self.calendar_ids = calendar_ids
+        self.time_min = time_min
+        self.time_max = time_max
+        self.page_size = page_size
+        self._first_pages = {
+            calendar_id: calendar_service.list_events_page(time_min, time_max, calendar_id, page_size=page_size)
+            for calendar_id in calendar_ids
+        }
+
+    @property
+    def last_modified(self) -> Optional[datetime.datetime]:
+        """Latest modification of any exported calendar."""
+        updated = [page['updated'] for page in self._first_pages.values() if page.get('updated')]
+        return max(datetime.datetime.fromisoformat(value) for value in updated) if updated else None
+
+    @property
+    def etag(self) -> str:
+        """Changes whenever one of the calendars or the requested range changes."""
+        digest = hashlib.sha1(f"{self.time_min.isoformat()}|{self.time_max.isoformat()}".encode())
+        for calendar_id in self.calendar_ids:
+            page = self._first_pages[calendar_id]
+            digest.update(f"|{calendar_id}|{page.get('etag')}|{page.get('updated')}".encode())
+        return digest.hexdigest()
+
+    def iter_chunks(self) -> Iterator[str]:
+        yield "".join(fold_line(line) for line in (
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            f"PRODID:{PRODUCT_ID}",
+            "CALSCALE:GREGORIAN",
+            "METHOD:PUBLISH",
+        ))
+
+        count = 0
+        for calendar_id in self.calendar_ids:
+            page = self._first_pages.pop(calendar_id)
+            while True:
+                for event in page.get('items', []):
+                    if event.get('status') == 'cancelled' or not event.get('start'):
+                        continue
+                    count += 1
+                    yield format_event(event)
+                page_token = page.get('nextPageToken')
+                if not page_token:
+                    break
+                page = self.calendar_service.list_events_page(self.time_min, self.time_max, calendar_id,
+                                                              page_token=page_token, page_size=self.page_size)
+
+        yield fold_line("END:VCALENDAR")
+        logger.info("Exported %s events from %s calendars.", count, len(self.calendar_ids))
@@ -0,0 +1,150 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import reprlib
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Correlates log records with the request that produced them
+REQUEST_ID = contextvars.ContextVar('request_id', default='-')
+
+# Records waiting for the writer thread; when full, new records are dropped instead of blocking
+DEFAULT_QUEUE_SIZE = 10000
+# Share of records marked as verbose (e.g. full tool results) that are kept
+DEFAULT_PAYLOAD_SAMPLE_RATE = 0.1
+
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 4
+_payload_repr.maxdict = 20
+_payload_repr.maxlist = 20
+_payload_repr.maxstring = 200
+_payload_repr.maxother = 200
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class Payload:
+    """
+    Wraps a large object passed as a log argument. It is only turned into text, bounded in size,
+    when the record is written by the background thread. The object must not be mutated afterwards.
+    """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return _payload_repr.repr(self.obj)
+
+
+class RequestContextFilter(logging.Filter):
+    """Attaches the current request id; runs on the thread that logs."""
+    def filter(self, record):
+        record.request_id = REQUEST_ID.get()
+        return True
+
+
+class PayloadSamplingFilter(logging.Filter):
+    """Keeps only a sample of records logged with extra={'verbose': True}."""
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return not getattr(record, 'verbose', False) or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread without formatting them and without ever blocking.
+    Formatting (including lazy %-arguments) happens on the writer thread.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+    def format(self, record):
+        entry = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, 'request_id', '-'),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _parse_levels(spec: str):
+    """Parses 'calendar_service=DEBUG,model_router=WARNING'."""
+    levels = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging():
+    """
+    Routes all logging through a bounded queue to a background writer.
+    Configured with BILLABEE_LOG_LEVEL, BILLABEE_LOG_LEVELS (per logger), BILLABEE_LOG_FORMAT (json or text),
+    BILLABEE_LOG_QUEUE_SIZE and BILLABEE_LOG_PAYLOAD_SAMPLE_RATE.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        if os.getenv('BILLABEE_LOG_FORMAT', 'json') == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter('%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s')
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(formatter)
+
+        queue_size = int(os.getenv('BILLABEE_LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+        sample_rate = float(os.getenv('BILLABEE_LOG_PAYLOAD_SAMPLE_RATE', DEFAULT_PAYLOAD_SAMPLE_RATE))
+        queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+        queue_handler.addFilter(RequestContextFilter())
+        queue_handler.addFilter(PayloadSamplingFilter(sample_rate))
+
+        root = logging.getLogger()
+        root.handlers = [queue_handler]
+        root.setLevel(os.getenv('BILLABEE_LOG_LEVEL', 'INFO').upper())
+        for name, level in _parse_levels(os.getenv('BILLABEE_LOG_LEVELS', '')).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = QueueListener(queue_handler.queue, stream_handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+def dropped_records() -> int:
+    """Number of records dropped because the writer could not keep up."""
+    handlers = [handler for handler in logging.getLogger().handlers if isinstance(handler, NonBlockingQueueHandler)]
+    return sum(handler.dropped for handler in handlers)
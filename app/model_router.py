@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import deque
+
+import openai
+
+from deadline import call_timeout, current_deadline, exceeded
+
+# Model tiers per pipeline stage, fastest first and strongest last
+DEFAULT_STAGE_MODELS = {
+    "planner": ["gpt-4o"],
+    "translator": ["gpt-4o-mini", "gpt-4o"],
+    "summarizer": ["gpt-4o-mini", "gpt-4o"],
+}
+# Typical latency (seconds) a stage tolerates before a faster tier is preferred
+DEFAULT_LATENCY_BUDGETS = {
+    "planner": 8.0,
+    "translator": 3.0,
+    "summarizer": 5.0,
+}
+# Weight of the newest sample in the moving latency average
+EWMA_ALPHA = 0.2
+# Seconds after which a tier skipped for being over budget gets one call again, so its average can recover
+PROBE_INTERVAL = 60.0
+
+
+def stage_models_from_env():
+    """Reads per-stage overrides such as BILLABEE_MODELS_TRANSLATOR="gpt-4o-mini,gpt-4o"."""
+    stage_models = {}
+    for stage, models in DEFAULT_STAGE_MODELS.items():
+        override = os.getenv(f"BILLABEE_MODELS_{stage.upper()}")
+        stage_models[stage] = [model.strip() for model in override.split(",") if model.strip()] if override else list(models)
+    return stage_models
+
+
+def latency_budgets_from_env():
+    """Reads per-stage overrides such as BILLABEE_LATENCY_BUDGET_TRANSLATOR=2.5."""
+    return {
+        stage: float(os.getenv(f"BILLABEE_LATENCY_BUDGET_{stage.upper()}", budget))
+        for stage, budget in DEFAULT_LATENCY_BUDGETS.items()
+    }
+
+
+class ModelRouter:
+    """
+    Routes each LLM call to a model based on its pipeline stage.
+
+    By default the first (fastest) tier of a stage is used. A tier whose moving average
+    latency exceeds the stage's budget is skipped in favour of the fastest measured tier, except for
+    an occasional probe call that lets its average recover once it is fast again, and callers can escalate to the strongest tier, e.g. after a validation failure.
+    Latency and error counts are recorded per model.
+    """
+
+    def __init__(self, stage_models: dict[str, list[str]] | None = None, latency_budgets: dict[str, float] | None = None):
+        self.stage_models = stage_models or stage_models_from_env()
+        self.latency_budgets = latency_budgets or latency_budgets_from_env()
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._client = None
+
+    def choose(self, stage: str, escalate: bool = False) -> str:
+        """Picks the model for a stage."""
+        tiers = self.stage_models[stage]
+        if escalate:
+            return tiers[-1]
+
+        budget = self.latency_budgets.get(stage)
+        now = time.monotonic()
+        with self._lock:
+            for model in tiers:
+                stats = self._stats.get(model)
+                # Unmeasured models are tried before giving up on the budget
+                if budget is None or stats is None or stats["ewma"] <= budget:
+                    return model
+                if now - stats["last_call"] >= PROBE_INTERVAL:
+                    # Claimed here, so concurrent requests do not all probe the slow tier at once
+                    stats["last_call"] = now
+                    return model
+            return min(tiers, key=lambda model: self._stats[model]["ewma"])
+
+    def complete(self, stage: str, messages: list[dict], escalate: bool = False, **kwargs) -> str:
+        """
+        Runs a chat completion for the stage and returns the stripped content.
+        Inside a request deadline, the call's timeout is the remaining time budget.
+        """
+        model = self.choose(stage, escalate=escalate)
+        client = self._openai()
+        timeout = call_timeout(stage)
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+            # A retry would get the whole remaining budget again
+            client = client.with_options(max_retries=0)
+        started = time.monotonic()
+        try:
+            response = client.chat.completions.create(model=model, messages=messages, **kwargs)
+        except openai.APITimeoutError:
+            self.record(model, time.monotonic() - started, ok=False)
+            deadline = current_deadline()
+            if deadline and deadline.expired():
+                raise exceeded(stage)
+            raise
+        except Exception:
+            self.record(model, time.monotonic() - started, ok=False)
+            raise
+        self.record(model, time.monotonic() - started)
+        content = response.choices[0].message.content
+        return content.strip() if content is not None else ""
+
+    def _openai(self):
+        with self._lock:
+            if self._client is None:
+                # Created on first use, after the app has set the API key
+                self._client = openai.OpenAI(api_key=openai.api_key)
+            return self._client
+
+    def record(self, model: str, seconds: float, ok: bool = True):
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None:
+                stats = self._stats[model] = {"calls": 0, "errors": 0, "ewma": seconds, "recent": deque(maxlen=200)}
+            stats["calls"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["ewma"] = EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * stats["ewma"]
+            stats["recent"].append(seconds)
+            stats["last_call"] = time.monotonic()
+
+    def stats(self) -> dict:
+        """Per-model call counts and latencies in milliseconds."""
+        with self._lock:
+            result = {}
+            for model, stats in self._stats.items():
+                recent = sorted(stats["recent"])
+                result[model] = {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "ewma_ms": round(stats["ewma"] * 1000),
+                    "p50_ms": round(recent[len(recent) // 2] * 1000),
+                    "p95_ms": round(recent[int(len(recent) * 0.95)] * 1000),
+                }
+            return result
@@ -1,6 +1,6 @@
 import datetime
 from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 
 # Based on Google Calendar API v3 Event resource documentation:
 # https://developers.google.com/calendar/api/v3/reference/events#resource
@@ -25,6 +25,7 @@ class GoogleCalendarEvent(BaseModel):
     """Pydantic model representing a Google Calendar event resource."""
     kind: str = "calendar#event"
     id: Optional[str] = Field(None, description="Opaque identifier of the event.")
+    etag: Optional[str] = Field(None, description="ETag of the resource, used for conditional updates.")
     status: Optional[str] = Field(None, description="Status of the event ('confirmed', 'tentative', 'cancelled').")
     html_link: Optional[str] = Field(None, alias='htmlLink', description="URL for the event in the Google Calendar UI.")
     created: Optional[datetime.datetime] = Field(None, description="Creation time of the event (RFC3339 format).")
@@ -76,6 +77,7 @@ class EventUpdateRequest(BaseModel):
     location: Optional[str] = None
     colorId: Optional[str] = Field(None, alias='colorId', description="Google Calendar color ID (1-11).")
     theme: Optional[str] = Field(None, exclude=True, description="High-level theme to infer color.")
+    etag: Optional[str] = Field(None, exclude=True, description="ETag of the version being edited; the update fails if the event changed since.")
     # Add other updatable fields
 
 # Define NotificationSettings first as it's used in CalendarListEntry
@@ -215,3 +217,12 @@ class DeleteEventRequest(BaseModel):
     """Represents a request to delete an event."""
     event_id: str
 
+# --- Plan Execution ---
+class PlanOperation(BaseModel):
+    """A single step of an agreed plan: create, update or delete one event."""
+    action: Literal["create", "update", "delete"]
+    parameters: dict[str, Any] = Field(default_factory=dict, description="The arguments for the matching create/update/delete request model.")
+
+class ExecutePlanRequest(BaseModel):
+    """Represents a whole agreed plan that is executed in one go."""
+    operations: List[PlanOperation] = Field(..., min_length=1)
@@ -0,0 +1,130 @@
+import copy
+from models import *
+from context import AppContext
+from action import create_event_action, update_event_action, delete_event_action
+from pydantic import ValidationError
+from logger import get_logger
+from deadline import call_timeout, deadline_scope
+
+logger = get_logger(__name__)
+
+# Request model used to validate the parameters of each plan action
+PLAN_ACTION_MODELS = {
+    "create": EventCreateRequest,
+    "update": EventUpdateRequest,
+    "delete": DeleteEventRequest,
+}
+# Time (seconds) a rollback gets of its own, also when the request's deadline has run out
+ROLLBACK_GRACE_SECONDS = 10.0
+
+
+class PlanValidationError(Exception):
+    """Raised when an operation of a plan does not validate. Nothing has been executed yet."""
+    def __init__(self, index: int, details: Any):
+        super().__init__(f"Plan operation {index} is invalid.")
+        self.index = index
+        self.details = details
+
+
+def compile_plan(plan_model: ExecutePlanRequest):
+    """
+    Validates every operation of the plan against its request model before anything is executed.
+    Returns a list of (action, request_model) tuples.
+    """
+    compiled = []
+    for index, operation in enumerate(plan_model.operations):
+        try:
+            request_model = PLAN_ACTION_MODELS[operation.action](**operation.parameters)
+        except ValidationError as e:
+            raise PlanValidationError(index, e.errors())
+
+        start = getattr(request_model, 'start', None)
+        end = getattr(request_model, 'end', None)
+        if operation.action == "create" and (start.dateTime is None or end.dateTime is None):
+            raise PlanValidationError(index, "Start and end times must not be None.")
+        if start and end and start.dateTime and end.dateTime and end.dateTime <= start.dateTime:
+            raise PlanValidationError(index, "End time must be after the start time.")
+
+        compiled.append((operation.action, request_model))
+    return compiled
+
+
+def _rollback(context: AppContext, applied: list):
+    """
+    Reverts already applied operations in reverse order.
+    Returns the list of rollback errors, empty if everything was reverted.
+    """
+    service = context.calendar_service
+    errors = []
+    for action, result, snapshot in reversed(applied):
+        try:
+            if action == "create":
+                service.delete_event(event_id=result['id'])
+            elif action == "update":
+                # A patch would keep fields the plan added, so the snapshot replaces the event as a whole
+                service.replace_event(event_id=snapshot['id'], event_data=snapshot)
+            elif action == "delete":
+                # Deleted events stay around as 'cancelled' and can be restored in place
+                service.replace_event(event_id=snapshot['id'], event_data={**snapshot, 'status': 'confirmed'})
+        except Exception as e:
+            logger.error("Rollback of '%s' failed: %s", action, e)
+            errors.append({"action": action, "error": str(e)})
+    return errors
+
+
+def execute_plan_action(context: AppContext, plan_model: ExecutePlanRequest):
+    """
+    Executes a whole plan of create/update/delete operations in one go.
+    If any operation fails, the operations already applied are rolled back.
+    """
+    if not context.calendar_service:
+        raise Exception("Calendar service not initialized.")
+
+    compiled = compile_plan(plan_model)
+    logger.info("Executing plan with %s operations", len(compiled))
+
+    if context.write_queue:
+        # Queued writes never fail synchronously, so a plan could not be rolled back through the queue.
+        # Plans go to Google directly, once the writes queued before them are saved.
+        if not context.write_queue.flush(timeout=call_timeout('calendar')):
+            return {"error": "Earlier calendar changes are still being saved. Nothing of the plan was executed."}
+        context = copy.copy(context)
+        context.calendar_service = context.write_queue.calendar_service
+
+    # Snapshot events that will be changed so they can be restored on failure
+    snapshots = {}
+    for action, request_model in compiled:
+        if action in ("update", "delete") and request_model.event_id not in snapshots:
+            snapshots[request_model.event_id] = context.calendar_service.get_event(event_id=request_model.event_id)
+
+    applied = []
+    for index, (action, request_model) in enumerate(compiled):
+        try:
+            if action == "create":
+                result = create_event_action(context, request_model)
+                applied.append((action, result, None))
+            elif action == "update":
+                result = update_event_action(context, request_model)
+                applied.append((action, result, snapshots[request_model.event_id]))
+            else:
+                result = delete_event_action(context, request_model)
+                applied.append((action, result, snapshots[request_model.event_id]))
+        except Exception as e:
+            logger.error("Plan operation %s ('%s') failed: %s. Rolling back.", index, action, e)
+            # The failure may be the spent request deadline, so the rollback gets a budget of its own
+            with deadline_scope(ROLLBACK_GRACE_SECONDS):
+                rollback_errors = _rollback(context, applied)
+            return {
+                "error": "The plan could not be executed and was rolled back." if not rollback_errors
+                         else "The plan could not be executed and could only partly be rolled back.",
+                "failed_operation": index,
+                "details": str(e),
+                "rolled_back": len(applied) - len(rollback_errors),
+                "rollback_errors": rollback_errors,
+            }
+
+    return {
+        "status": "success",
+        "message": f"The plan with {len(applied)} operations was executed successfully.",
+        "results": [result for _, result, _ in applied],
+    }
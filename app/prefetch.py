@@ -0,0 +1,99 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from deadline import call_timeout, deadline_scope
+from event_store import EventStore
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Queries that do not narrow down a calendar lookup ("check the calendar for Wednesday")
+GENERIC_QUERIES = {"", "*", "event", "events", "all", "all events", "everything", "calendar",
+                   "my calendar", "schedule", "agenda", "plans", "appointments"}
+# Upper bound on events returned for a window answered from the prefetch
+MAX_PREFETCH_RESULTS = 50
+# Time budget (seconds) of a prefetch; it is shared by later requests, so it does not use theirs
+PREFETCH_TIMEOUT = 15.0
+
+
+class CalendarPrefetcher:
+    """
+    Speculatively loads the user's events for today and the next few days in the background,
+    so that a calendar lookup requested by the assistant can be answered without waiting for Google.
+    """
+
+    def __init__(self, calendar_service, days: int = 3, ttl: float = 120.0):
+        self.calendar_service = calendar_service
+        self.days = days
+        self.ttl = ttl
+        self._entry = None  # {"time_min", "time_max", "future", "started_at"}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="calendar-prefetch")
+
+    def start(self, timezone: Optional[str] = None):
+        """Starts a prefetch of today plus `days` days, unless a fresh one is already running or done."""
+        try:
+            tz = ZoneInfo(timezone or "Europe/Berlin")
+        except Exception:
+            tz = ZoneInfo("Europe/Berlin")
+        today = datetime.datetime.now(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        time_min, time_max = today, today + datetime.timedelta(days=self.days + 1)
+
+        with self._lock:
+            entry = self._entry
+            if entry and self._is_fresh(entry) and entry["time_min"] <= time_min and entry["time_max"] >= time_max:
+                return
+            future = self._executor.submit(self._load, time_min, time_max)
+            self._entry = {"time_min": time_min, "time_max": time_max,
+                           "future": future, "started_at": time.monotonic()}
+
+    def lookup(self, query: str, time_min: datetime.datetime, time_max: datetime.datetime):
+        """
+        Answers a lookup from the prefetched events, waiting for an in-flight prefetch if needed.
+        Returns None if the prefetch does not cover the window or failed.
+        """
+        with self._lock:
+            entry = self._entry
+        if entry is None or not self._is_fresh(entry):
+            return None
+
+        # Naive times are UTC, like everywhere else the assistant's times are used
+        time_min = time_min if time_min.tzinfo else time_min.replace(tzinfo=datetime.timezone.utc)
+        time_max = time_max if time_max.tzinfo else time_max.replace(tzinfo=datetime.timezone.utc)
+        if time_min < entry["time_min"] or time_max > entry["time_max"]:
+            return None
+
+        try:
+            # Waiting is bounded by the caller's deadline; on timeout the caller asks Google itself
+            events = entry["future"].result(timeout=call_timeout('calendar'))
+        except FutureTimeoutError:
+            logger.warning("Prefetch still running, falling back to Google.")
+            return None
+        except Exception as e:
+            logger.error("Prefetch failed, falling back to Google: %s", e)
+            return None
+
+        store = EventStore()
+        for event in events:
+            store.add(event)
+        query = (query or "").strip().lower()
+        if query in GENERIC_QUERIES:
+            query = ""
+        logger.info("Answering calendar lookup from prefetch (%s events cached).", len(events))
+        return store.search(query, time_min=time_min, time_max=time_max, max_results=MAX_PREFETCH_RESULTS)
+
+    def invalidate(self):
+        """Drops the prefetched events, e.g. after the calendar was changed."""
+        with self._lock:
+            self._entry = None
+
+    def _load(self, time_min: datetime.datetime, time_max: datetime.datetime):
+        with deadline_scope(PREFETCH_TIMEOUT):
+            return self.calendar_service.list_events(time_min, time_max)
+
+    def _is_fresh(self, entry) -> bool:
+        return time.monotonic() - entry["started_at"] < self.ttl
@@ -0,0 +1,112 @@
+import functools
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from flask import request, g
+
+from constants import APP_PATH
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Sampling interval of the stack sampler in seconds
+DEFAULT_SAMPLE_INTERVAL = 0.005
+DEFAULT_PROFILE_DIR = APP_PATH / 'profiles'
+
+
+class StackSampler:
+    """
+    Low-overhead sampling profiler for one thread.
+    A background thread periodically records the target thread's stack and counts identical stacks,
+    which can be written in the collapsed-stack format used by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id: int, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started_at
+        return self
+
+    def write_collapsed(self, path: Path):
+        """Writes one 'frame;frame;frame count' line per distinct stack."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(frames))] += 1
+            self.samples += 1
+
+
+def _should_profile() -> bool:
+    # Read per request so settings loaded from env/production.env after import apply
+    header = request.headers.get('X-Billabee-Profile')
+    profile_token = os.getenv('BILLABEE_PROFILE_TOKEN')
+    if header and profile_token and hmac.compare_digest(header, profile_token):
+        return True
+    sample_rate = float(os.getenv('BILLABEE_PROFILE_SAMPLE_RATE', '0'))
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def _request_id() -> str:
+    request_id = request.headers.get('X-Request-ID') or getattr(g, 'request_id', None) or uuid.uuid4().hex
+    # Request ids end up in file names
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', request_id)[:64]
+
+
+def profiled(view):
+    """
+    Decorator for Flask views: profiles the request when it carries a valid X-Billabee-Profile
+    header or falls into the sampled fraction, and writes <request id>.collapsed to the profile directory.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _should_profile():
+            return view(*args, **kwargs)
+
+        request_id = _request_id()
+        interval = float(os.getenv('BILLABEE_PROFILE_INTERVAL', DEFAULT_SAMPLE_INTERVAL))
+        sampler = StackSampler(threading.get_ident(), interval=interval).start()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            sampler.stop()
+            try:
+                profile_dir = Path(os.getenv('BILLABEE_PROFILE_DIR', DEFAULT_PROFILE_DIR))
+                path = sampler.write_collapsed(profile_dir / f"{int(time.time())}-{request_id}.collapsed")
+                logger.info("Profiled %s (%s samples in %.2fs): %s", request.path, sampler.samples, sampler.duration, path)
+            except OSError as e:
+                logger.error("Could not write profile for request %s: %s", request_id, e)
+    return wrapper
@@ -0,0 +1,377 @@
+import datetime
+import hashlib
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+from googleapiclient.errors import HttpError
+
+from event_store import EventStore
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# How far back the initial full sync of a calendar reaches
+INITIAL_SYNC_DAYS = 30
+# Renew channels this many seconds before Google expires them
+RENEWAL_MARGIN = 3600
+# Longest time (seconds) the mirror answers reads without a successful sync, in case a notification is lost
+MAX_MIRROR_AGE = 300
+
+
+class EventMirror:
+    """
+    Local copy of the events of watched calendars, kept current by incremental syncs.
+    Reads can be answered from the mirror while the calendar's push channel is active and the
+    last successful sync is at most max_age seconds old; a background resync keeps it that fresh,
+    so a lost notification leaves the mirror stale for minutes rather than until the channel expires.
+
+    With several worker processes, notifications reach only one of them. Given a directory shared
+    by the workers, mark_changed() leaves a per-calendar marker there, and every worker stops
+    trusting (and re-syncs) its mirror once the marker is newer than its last sync.
+    """
+
+    def __init__(self, calendar_service, max_age: float = MAX_MIRROR_AGE, shared_dir: Optional[str] = None):
+        self.calendar_service = calendar_service
+        self.max_age = max_age
+        self.shared_dir = shared_dir
+        self._events = {}  # calendar_id -> EventStore
+        self._sync_tokens = {}  # calendar_id -> next sync token
+        self._synced_at = {}  # calendar_id -> start of the last successful sync (epoch seconds)
+        self._watched_until = {}  # calendar_id -> channel expiration (epoch seconds)
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._resync_thread = None
+
+    def is_trusted(self, calendar_id: str) -> bool:
+        """True if the calendar is synced recently and a push channel will tell us about changes."""
+        now = time.time()
+        with self._lock:
+            trusted = (calendar_id in self._sync_tokens
+                       and calendar_id not in self._dirty
+                       and self._watched_until.get(calendar_id, 0) > now
+                       and now - self._synced_at.get(calendar_id, 0) < self.max_age)
+            synced_at = self._synced_at.get(calendar_id, 0)
+        if trusted and self._changed_since(calendar_id, synced_at):
+            # Another worker received a notification for this calendar
+            self.request_resync(calendar_id)
+            return False
+        return trusted
+
+    def mark_changed(self, calendar_id: str):
+        """Handles a change notification: re-syncs this worker's mirror and tells the other workers."""
+        if self.shared_dir:
+            with open(self._marker_path(calendar_id), 'a'):
+                os.utime(self._marker_path(calendar_id))
+        self.request_resync(calendar_id)
+
+    def start_periodic_resync(self, interval: Optional[float] = None):
+        """Starts a background thread that re-syncs every mirrored calendar well within max_age."""
+        if self._resync_thread:
+            return
+        interval = interval or self.max_age / 3
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                with self._lock:
+                    calendar_ids = list(self._sync_tokens)
+                for calendar_id in calendar_ids:
+                    self._resync_quietly(calendar_id)
+
+        self._resync_thread = threading.Thread(target=loop, name="calendar-mirror-resync", daemon=True)
+        self._resync_thread.start()
+
+    def set_watched(self, calendar_id: str, expiration: float | None):
+        with self._lock:
+            if expiration is None:
+                self._watched_until.pop(calendar_id, None)
+            else:
+                self._watched_until[calendar_id] = expiration
+
+    def resync(self, calendar_id: str):
+        """Applies the changes since the last sync token, or does a full sync if there is none."""
+        with self._sync_lock:
+            with self._lock:
+                self._dirty.discard(calendar_id)
+                sync_token = self._sync_tokens.get(calendar_id)
+            # Changes made after this moment are not guaranteed to be in the fetched batch
+            started = time.time()
+            try:
+                changes, next_token = self._fetch_changes(calendar_id, sync_token)
+            except HttpError as error:
+                if error.resp.status != 410:
+                    with self._lock:
+                        self._dirty.add(calendar_id)
+                    raise
+                # Sync token expired, start over with a full sync
+                logger.info("Sync token for '%s' expired. Running a full sync.", calendar_id)
+                sync_token = None
+                changes, next_token = self._fetch_changes(calendar_id, None)
+
+            with self._lock:
+                store = EventStore() if sync_token is None else self._events.get(calendar_id, EventStore())
+                for event in changes:
+                    if event.get('status') == 'cancelled':
+                        store.remove(event.get('id'))
+                    else:
+                        store.add(event, calendar_id)
+                self._events[calendar_id] = store
+                self._sync_tokens[calendar_id] = next_token
+                self._synced_at[calendar_id] = started
+            logger.info("Synced %s event changes for calendar '%s'.", len(changes), calendar_id)
+
+    def request_resync(self, calendar_id: str):
+        """Marks the calendar as stale and re-syncs it in the background."""
+        with self._lock:
+            self._dirty.add(calendar_id)
+        threading.Thread(target=self._resync_quietly, args=(calendar_id,), daemon=True).start()
+
+    def apply_write(self, calendar_id: str, event: Optional[dict] = None, deleted_id: Optional[str] = None):
+        """
+        Applies an event we just wrote (or deleted) to the mirror, so reads in the same turn see it
+        before the push notification about it arrives.
+        """
+        with self._lock:
+            store = self._events.get(calendar_id)
+            if store is None:
+                return
+            if deleted_id is not None or (event and event.get('status') == 'cancelled'):
+                store.remove(deleted_id or event.get('id'))
+            elif event and event.get('id'):
+                store.add(event, calendar_id)
+
+    def search(self, calendar_id: str, query: str = "", time_min: Optional[datetime.datetime] = None,
+               time_max: Optional[datetime.datetime] = None, max_results: Optional[int] = None):
+        """Searches the mirrored events like events().list(q=..., timeMin=..., orderBy='startTime') would."""
+        with self._lock:
+            store = self._events.get(calendar_id)
+            if store is None:
+                return []
+            return store.search(query, time_min=time_min, time_max=time_max, max_results=max_results)
+
+    def get(self, calendar_id: str, event_id: str):
+        """Returns a mirrored event by id, or None."""
+        with self._lock:
+            store = self._events.get(calendar_id)
+            return store.get(event_id) if store else None
+
+    def _fetch_changes(self, calendar_id: str, sync_token: Optional[str]):
+        time_min = None
+        if sync_token is None:
+            time_min = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=INITIAL_SYNC_DAYS)).isoformat()
+        return self.calendar_service.list_event_changes(calendar_id, sync_token=sync_token, time_min=time_min)
+
+    def _marker_path(self, calendar_id: str) -> str:
+        name = hashlib.sha1(calendar_id.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.shared_dir, f"changed-{name}")
+
+    def _changed_since(self, calendar_id: str, moment: float) -> bool:
+        if not self.shared_dir:
+            return False
+        try:
+            return os.stat(self._marker_path(calendar_id)).st_mtime > moment
+        except FileNotFoundError:
+            return False
+
+    def _resync_quietly(self, calendar_id: str):
+        try:
+            self.resync(calendar_id)
+        except Exception as e:
+            logger.error("Re-sync of calendar '%s' failed: %s", calendar_id, e)
+
+
+class ChannelManager:
+    """
+    Registers, renews and tears down events.watch channels for the user's calendars
+    and turns incoming notifications into targeted re-syncs of the mirror.
+
+    With several worker processes, pass a directory shared by them as shared_dir (Unix only): the
+    channels are then recorded in a file there, each calendar gets one channel for all workers, and
+    a notification is accepted by whichever worker Google's request reaches.
+    """
+
+    def __init__(self, calendar_service, mirror: EventMirror, address: str, token: Optional[str] = None,
+                 ttl: Optional[int] = None, shared_dir: Optional[str] = None):
+        self.calendar_service = calendar_service
+        self.mirror = mirror
+        self.address = address
+        # Shared verification token; a random one per channel is used if none is configured
+        self.token = token
+        self.ttl = ttl
+        self.shared_dir = shared_dir
+        self.channels = {}  # channel_id -> {"calendar_id", "resource_id", "token", "expiration"}
+        self._lock = threading.Lock()
+        self._renewal_thread = None
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    def register(self, calendar_id: str = 'primary'):
+        """
+        Opens a channel for the calendar and syncs it so reads can be served locally.
+        With shared_dir, a channel another worker opened and that is not about to expire is reused.
+        """
+        with self._shared_channels() as shared:
+            existing = next(((channel_id, channel) for channel_id, channel in shared.items()
+                             if channel["calendar_id"] == calendar_id
+                             and channel["expiration"] - time.time() > RENEWAL_MARGIN), None)
+            if existing:
+                channel_id, channel = existing
+            else:
+                channel_id = str(uuid.uuid4())
+                token = self.token or secrets.token_urlsafe(24)
+                response = self.calendar_service.watch_events(calendar_id, channel_id, self.address, token=token, ttl=self.ttl)
+                channel = {
+                    "calendar_id": calendar_id,
+                    "resource_id": response.get('resourceId'),
+                    "token": token,
+                    # Google reports the expiration in milliseconds since the epoch
+                    "expiration": int(response.get('expiration', 0)) / 1000 or time.time() + (self.ttl or 604800),
+                }
+                shared[channel_id] = channel
+
+        with self._lock:
+            self.channels[channel_id] = channel
+        self.mirror.resync(calendar_id)
+        self.mirror.set_watched(calendar_id, max(other["expiration"] for other in self.channels.values()
+                                                 if other["calendar_id"] == calendar_id))
+        return channel_id
+
+    def renew_expiring(self, margin: int = RENEWAL_MARGIN):
+        """Replaces channels that expire within `margin` seconds with fresh ones."""
+        with self._lock:
+            expiring = [(channel_id, channel) for channel_id, channel in self.channels.items()
+                        if channel["expiration"] - time.time() < margin]
+        for channel_id, channel in expiring:
+            try:
+                new_channel_id = self.register(channel["calendar_id"])
+            except Exception as e:
+                logger.error("Could not renew channel for '%s': %s", channel['calendar_id'], e)
+                continue
+            if new_channel_id != channel_id:
+                self._stop(channel_id)
+
+    def teardown(self, calendar_id: Optional[str] = None):
+        """Stops all channels, or only those of one calendar."""
+        with self._lock:
+            channel_ids = [channel_id for channel_id, channel in self.channels.items()
+                           if calendar_id is None or channel["calendar_id"] == calendar_id]
+        for channel_id in channel_ids:
+            self._stop(channel_id)
+
+    def handle_notification(self, headers) -> bool:
+        """
+        Handles a push notification from Google. Returns False if it does not belong to one of our channels.
+        """
+        channel_id = headers.get('X-Goog-Channel-ID')
+        with self._lock:
+            channel = self.channels.get(channel_id)
+        if channel is None and self.shared_dir:
+            # A channel another worker opened
+            with self._shared_channels() as shared:
+                channel = shared.get(channel_id)
+        if channel is None or not secrets.compare_digest(headers.get('X-Goog-Channel-Token', ''), channel["token"]):
+            return False
+
+        state = headers.get('X-Goog-Resource-State')
+        if state != 'sync':
+            # 'exists' / 'not_exists': something changed in the calendar
+            self.mirror.mark_changed(channel["calendar_id"])
+            if self.calendar_service.shared_cache:
+                self.calendar_service.shared_cache.invalidate(channel["calendar_id"])
+        return True
+
+    def start_renewal(self, interval: int = 600):
+        """Starts a background thread that renews channels before they expire."""
+        if self._renewal_thread:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.renew_expiring()
+
+        self._renewal_thread = threading.Thread(target=loop, name="calendar-channel-renewal", daemon=True)
+        self._renewal_thread.start()
+
+    @contextmanager
+    def _shared_channels(self):
+        """
+        The channels recorded in shared_dir, under an exclusive lock; changes are saved on exit.
+        Without shared_dir this process's own channels are used.
+        """
+        if not self.shared_dir:
+            with self._lock:
+                channels = dict(self.channels)
+            yield channels
+            return
+
+        import fcntl  # Unix only, like the shared directory itself
+        path = os.path.join(self.shared_dir, "channels.json")
+        lock_fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                with open(path) as f:
+                    channels = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                channels = {}
+            before = json.dumps(channels, sort_keys=True)
+            yield channels
+            # Expired channels are of no use to anyone
+            channels = {channel_id: channel for channel_id, channel in channels.items() if channel["expiration"] > time.time()}
+            if json.dumps(channels, sort_keys=True) != before:
+                temporary = f"{path}.{os.getpid()}.tmp"
+                with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+                    json.dump(channels, f)
+                os.replace(temporary, path)
+        finally:
+            os.close(lock_fd)
+
+    def _stop(self, channel_id: str):
+        if self.shared_dir:
+            with self._shared_channels() as shared:
+                shared.pop(channel_id, None)
+        with self._lock:
+            channel = self.channels.pop(channel_id, None)
+            still_watched = [other["expiration"] for other in self.channels.values()
+                             if channel and other["calendar_id"] == channel["calendar_id"]]
+        if channel is None:
+            return
+        self.mirror.set_watched(channel["calendar_id"], max(still_watched) if still_watched else None)
+        try:
+            self.calendar_service.stop_channel(channel_id, channel["resource_id"])
+        except Exception as e:
+            logger.error("Could not stop channel %s: %s", channel_id, e)
+
+
+def send_test_notification(url: str, channel_id: str, token: str, resource_state: str = 'exists'):
+    """
+    Local stand-in for Google: posts a push notification like events.watch would.
+    """
+    request = urllib.request.Request(url, data=b"", method='POST', headers={
+        'X-Goog-Channel-ID': channel_id,
+        'X-Goog-Channel-Token': token,
+        'X-Goog-Resource-State': resource_state,
+        'X-Goog-Resource-ID': 'local-stand-in',
+        'X-Goog-Message-Number': str(int(time.time())),
+    })
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+if __name__ == '__main__':
+    # Usage: python push_notifications.py <webhook_url> <channel_id> <token> [resource_state]
+    if len(sys.argv) < 4:
+        print("Usage: python push_notifications.py <webhook_url> <channel_id> <token> [resource_state]")
+        sys.exit(1)
+    status = send_test_notification(*sys.argv[1:5])
+    print(f"Notification delivered, webhook answered with {status}.")
@@ -0,0 +1,275 @@
+import datetime
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from constants import MAX_EVENTS
+from event_store import event_bounds
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# File layout (little endian):
+#   header   magic, version, reserved, created, time_min, time_max, max_duration, count
+#   records  count x (start, end, id offset/length, text offset/length, event offset/length), sorted by start
+#   data     event ids, lowercased search text (summary, description, location) and events as JSON
+# Times are epoch seconds; offsets are absolute positions in the file.
+MAGIC = b'BBSC'
+VERSION = 1
+HEADER = struct.Struct('<4sHHddddI')
+RECORD = struct.Struct('<ddIIIIII')
+
+
+def encode_snapshot(events: list[dict[str, Any]], time_min: datetime.datetime, time_max: datetime.datetime,
+                    created: Optional[float] = None) -> bytes:
+    """Serializes the events of a calendar window into the snapshot file format."""
+    rows = []
+    for event in events:
+        if event.get('status') == 'cancelled' or not event.get('start') or not event.get('end'):
+            continue
+        start, end = (moment.timestamp() for moment in event_bounds(event))
+        text = "\n".join(event.get(key) or "" for key in ('summary', 'description', 'location')).lower()
+        rows.append((start, end, event['id'].encode('utf-8'), text.encode('utf-8'),
+                     json.dumps(event, separators=(',', ':')).encode('utf-8')))
+    rows.sort(key=lambda row: row[0])
+
+    # A snapshot that hits the event limit only covers the window up to its last event
+    complete_until = time_max.timestamp()
+    if len(events) >= MAX_EVENTS and rows:
+        complete_until = min(complete_until, rows[-1][0])
+
+    offset = HEADER.size + RECORD.size * len(rows)
+    records, data = [], []
+    for start, end, event_id, text, blob in rows:
+        records.append(RECORD.pack(start, end, offset, len(event_id), offset + len(event_id), len(text),
+                                   offset + len(event_id) + len(text), len(blob)))
+        data.extend((event_id, text, blob))
+        offset += len(event_id) + len(text) + len(blob)
+
+    max_duration = max((end - start for start, end, *_ in rows), default=0.0)
+    header = HEADER.pack(MAGIC, VERSION, 0, created or time.time(), time_min.timestamp(), complete_until,
+                         max_duration, len(rows))
+    return b"".join([header, *records, *data])
+
+
+class _Snapshot:
+    """A read-only mapping of one snapshot file. Records are read in place; only returned events are decoded."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        magic, version, _, self.created, self.time_min, self.time_max, self.max_duration, self.count = \
+            HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} event snapshot.")
+
+    def record(self, index: int):
+        return RECORD.unpack_from(self.buffer, HEADER.size + RECORD.size * index)
+
+    def first_ending_after(self, moment: float) -> int:
+        """Index of the first record that may end after moment (binary search on the start column)."""
+        low, high = 0, self.count
+        lower = moment - self.max_duration
+        while low < high:
+            middle = (low + high) // 2
+            if self.record(middle)[0] < lower:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def matches(self, record, query: bytes) -> bool:
+        text_offset, text_length = record[4], record[5]
+        return self.buffer.find(query, text_offset, text_offset + text_length) != -1
+
+    def event(self, record) -> dict[str, Any]:
+        blob_offset, blob_length = record[6], record[7]
+        return json.loads(self.buffer[blob_offset:blob_offset + blob_length])
+
+
+class SharedEventCache:
+    """
+    Event cache shared by all worker processes on a host through memory-mapped snapshot files.
+
+    Each calendar has one snapshot of its events from yesterday until `days` days ahead. Workers
+    map the file read-only and answer window and text queries straight from the mapping.
+    Writes follow a single-writer protocol: a worker refreshes a stale snapshot only while it
+    holds the calendar's exclusive flock, writes a temporary file and swaps it in with os.replace,
+    so readers always see either the old or the new complete file. Refreshes run in a background
+    thread; a read that finds no fresh snapshot starts one and reads from Google itself in the
+    meantime, so no request waits for (or fails with) a whole-window reload. Mutations invalidate the snapshot under
+    the same lock, so a refresh that started before the change cannot overwrite the invalidation.
+    """
+
+    def __init__(self, directory: str, days: int = 14, ttl: float = 60.0):
+        self.directory = directory
+        self.days = days
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self._snapshots = {}
+        self._refreshing = set()  # calendar ids with a background refresh running in this process
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "refreshes": 0, "invalidations": 0}
+
+    def list_events(self, calendar_id: str, time_min: datetime.datetime, time_max: datetime.datetime,
+                    max_results: int, load: Callable) -> Optional[list[dict[str, Any]]]:
+        """
+        Events overlapping [time_min, time_max) ordered by start, or None if the snapshot does not cover the window.
+        load(calendar_id, time_min, time_max) fetches a calendar window from Google for a refresh.
+        """
+        snapshot = self._fresh_snapshot(calendar_id, load)
+        if snapshot is None or time_min.timestamp() < snapshot.time_min or time_max.timestamp() > snapshot.time_max:
+            return self._count(None)
+
+        lower, upper = time_min.timestamp(), time_max.timestamp()
+        events = []
+        for index in range(snapshot.first_ending_after(lower), snapshot.count):
+            record = snapshot.record(index)
+            if record[0] >= upper or len(events) >= max_results:
+                break
+            if record[1] > lower:
+                events.append(snapshot.event(record))
+        return self._count(events)
+
+    def search_events(self, calendar_id: str, query: str, max_results: int, load: Callable) -> Optional[list[dict[str, Any]]]:
+        """
+        Like events().list(q=query, timeMin=now): the next max_results upcoming events matching the query.
+        Returns None unless the snapshot alone is conclusive, i.e. it holds max_results matches.
+        """
+        snapshot = self._fresh_snapshot(calendar_id, load)
+        now = time.time()
+        if snapshot is None or now < snapshot.time_min:
+            return self._count(None)
+
+        needle = (query or "").lower().encode('utf-8')
+        events = []
+        for index in range(snapshot.first_ending_after(now), snapshot.count):
+            record = snapshot.record(index)
+            if record[0] >= snapshot.time_max:
+                break
+            if record[1] > now and (not needle or snapshot.matches(record, needle)):
+                events.append(snapshot.event(record))
+                if len(events) >= max_results:
+                    return self._count(events)
+        return self._count(None)
+
+    def invalidate(self, calendar_id: str = 'primary'):
+        """Drops the snapshot of a calendar for all workers, e.g. after it was changed."""
+        lock_fd = os.open(self._path(calendar_id, '.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Waits for a running refresh, whose data may predate the change
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                os.unlink(self._path(calendar_id))
+            except FileNotFoundError:
+                pass
+        finally:
+            os.close(lock_fd)
+        with self._lock:
+            self._snapshots.pop(calendar_id, None)
+            self._counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+    def _fresh_snapshot(self, calendar_id: str, load: Callable) -> Optional[_Snapshot]:
+        snapshot = self._snapshot(calendar_id)
+        if snapshot is not None and self._is_fresh(snapshot):
+            return snapshot
+        self._refresh_in_background(calendar_id, load)
+        return None
+
+    def _refresh_in_background(self, calendar_id: str, load: Callable):
+        with self._lock:
+            if calendar_id in self._refreshing:
+                return
+            self._refreshing.add(calendar_id)
+
+        def run():
+            try:
+                self._refresh(calendar_id, load)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(calendar_id)
+
+        threading.Thread(target=run, name="shared-cache-refresh", daemon=True).start()
+
+    def _snapshot(self, calendar_id: str) -> Optional[_Snapshot]:
+        """The current snapshot, remapped when another worker has replaced the file."""
+        path = self._path(calendar_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            snapshot = self._snapshots.get(calendar_id)
+        if snapshot is not None and snapshot.identity == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            return snapshot
+        try:
+            snapshot = _Snapshot(path)
+        except (FileNotFoundError, ValueError, struct.error) as e:
+            logger.warning("Ignoring unreadable event snapshot for '%s': %s", calendar_id, e)
+            return None
+        # The replaced mapping stays valid for readers still using it and is closed once unreferenced
+        with self._lock:
+            self._snapshots[calendar_id] = snapshot
+        return snapshot
+
+    def _refresh(self, calendar_id: str, load: Callable) -> Optional[_Snapshot]:
+        lock_fd = os.open(self._path(calendar_id, '.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker (or thread) is refreshing right now
+                return None
+            snapshot = self._snapshot(calendar_id)
+            if snapshot is not None and self._is_fresh(snapshot):
+                return snapshot
+
+            today = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+            time_min, time_max = today - datetime.timedelta(days=1), today + datetime.timedelta(days=self.days + 1)
+            path = self._path(calendar_id)
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                events = load(calendar_id, time_min, time_max)
+                data = encode_snapshot(events, time_min, time_max)
+                with open(temporary, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporary, path)
+            except Exception as e:
+                # Readers keep going to Google until a later refresh succeeds
+                logger.error("Could not refresh the shared event snapshot for '%s': %s", calendar_id, e)
+                if os.path.exists(temporary):
+                    os.unlink(temporary)
+                return None
+        finally:
+            os.close(lock_fd)
+
+        with self._lock:
+            self._counters["refreshes"] += 1
+        logger.info("Refreshed shared event snapshot for '%s' (%s events, %s bytes).", calendar_id, len(events), len(data))
+        return self._snapshot(calendar_id)
+
+    def _is_fresh(self, snapshot: _Snapshot) -> bool:
+        return time.time() - snapshot.created < self.ttl
+
+    def _path(self, calendar_id: str, suffix: str = '.bin') -> str:
+        name = hashlib.sha1(calendar_id.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"events-{name}{suffix}")
+
+    def _count(self, events):
+        with self._lock:
+            self._counters["misses" if events is None else "hits"] += 1
+        return events
@@ -0,0 +1,62 @@
+import copy
+import threading
+from typing import Any, Callable, Hashable
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Deduplicates identical in-flight calls: while a call for a key is running, other callers
+    with the same key wait for it and share its result (or its exception) instead of issuing their own.
+    Followers get a deep copy so they cannot affect each other through the shared result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, timeout: float | None = None, **kwargs):
+        """
+        Runs fn(*args, **kwargs) unless the same key is already in flight.
+        timeout bounds how long a follower waits for the leader (TimeoutError).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.followers += 1
+                self.shared += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight call {key!r}.")
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        result = None
+        try:
+            result = fn(*args, **kwargs)
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                # No new followers can join once the key is gone
+                del self._calls[key]
+                followers = call.followers
+            if followers and call.error is None:
+                # The leader's caller owns `result`; followers copy from a private snapshot
+                call.result = copy.deepcopy(result)
+            call.done.set()
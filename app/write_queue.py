@@ -0,0 +1,310 @@
+import atexit
+import contextvars
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any
+
+from event_store import event_bounds
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# User on whose behalf calendar writes are made in the current context; failed writes are reported to them
+WRITE_OWNER = contextvars.ContextVar('write_owner', default=None)
+# Number of events whose ETag history from our own writes is remembered
+MAX_TRACKED_ETAGS = 1000
+
+
+class WriteBehindCalendar:
+    """
+    Write-behind queue in front of GoogleCalendarService.
+
+    Mutations are acknowledged immediately against a local view and flushed to Google
+    by a single background worker. Successive operations on the same event id are coalesced
+    into one net call (e.g. create -> update -> update becomes a single create, create -> delete
+    becomes nothing). Events are flushed in the order they were first touched, and the operations
+    of one event are never reordered. Failed writes are collected per user (WRITE_OWNER at the time
+    of the write) and can be drained by the chat loop.
+    Every other attribute is delegated to the wrapped calendar service.
+    """
+
+    def __init__(self, calendar_service, flush_delay: float = 2.0):
+        self.calendar_service = calendar_service
+        self.flush_delay = flush_delay
+        self._pending = OrderedDict()  # event_id -> {"ops": [...], "owners": set, "enqueued_at": float}
+        self._in_flight = None  # (event_id, ops) currently being written
+        self._failures = []
+        # event_id -> (ETags our own flushed writes superseded, ETag they produced); used by the worker only
+        self._own_etags = OrderedDict()
+        self._force = False
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name="calendar-write-behind", daemon=True)
+        self._worker.start()
+        atexit.register(self.flush)
+
+    def __getattr__(self, name):
+        return getattr(self.calendar_service, name)
+
+    # --- Mutations (acknowledged immediately) ---
+
+    def insert_event(self, event_body: dict[str, Any]):
+        """Queues an insert. A client-side event id is assigned so later operations can be coalesced."""
+        body = copy.deepcopy(event_body)
+        # Google accepts client ids made of base32hex characters, which a hex uuid satisfies
+        event_id = body.setdefault('id', uuid.uuid4().hex)
+        self._enqueue(event_id, "create", body)
+        return {**body, 'status': 'confirmed'}
+
+    def update_event(self, event_id: str, updated_data: dict[str, Any], etag: str | None = None):
+        """Queues an update and returns the event as it will look once flushed."""
+        self._enqueue(event_id, "update", copy.deepcopy(updated_data), etag)
+        _, view = self._local_view(event_id)
+        return {'id': event_id, **(view or {})}
+
+    def replace_event(self, event_id: str, event_data: dict[str, Any]):
+        """Queues the replacement of a whole event and returns the event as it will look once flushed."""
+        self._enqueue(event_id, "replace", copy.deepcopy(event_data))
+        _, view = self._local_view(event_id)
+        return {'id': event_id, **(view or {})}
+
+    def delete_event(self, event_id: str):
+        """Queues a delete."""
+        self._enqueue(event_id, "delete", None)
+
+    # --- Reads (overlaid with the local view) ---
+
+    def get_event(self, event_id: str):
+        state, view = self._local_view(event_id)
+        if state == "deleted":
+            raise KeyError(f"Event '{event_id}' was deleted.")
+        if state == "created":
+            return {**view, 'id': event_id}
+        event = self.calendar_service.get_event(event_id=event_id)
+        return {**event, **view} if view else event
+
+    def cached_event(self, event_id: str, calendar_id: str = 'primary'):
+        # The mirror does not know about queued changes, so only trust it for untouched events
+        state, _ = self._local_view(event_id)
+        if state is not None:
+            return None
+        return self.calendar_service.cached_event(event_id, calendar_id)
+
+    def search_events(self, query: str, *args, **kwargs):
+        events = self.calendar_service.search_events(query, *args, **kwargs)
+        return self._overlay(events, lambda view: query.lower() in (view.get('summary') or '').lower())
+
+    def list_events(self, time_min, time_max, *args, **kwargs):
+        events = self.calendar_service.list_events(time_min, time_max, *args, **kwargs)
+
+        def in_window(view):
+            start, end = event_bounds(view)
+            return start < time_max and end > time_min
+        return self._overlay(events, in_window)
+
+    def _overlay(self, events: list, include_created):
+        """Applies queued changes to events read from Google and adds matching events created locally."""
+        with self._cond:
+            touched = self._touched_ids()
+
+        result = []
+        for event in events:
+            state, view = self._local_view(event.get('id'))
+            if state == "deleted":
+                continue
+            result.append({**event, **view} if view else event)
+
+        # Events created locally that Google does not know about yet
+        seen = {event.get('id') for event in result}
+        for event_id in touched:
+            state, view = self._local_view(event_id)
+            if state == "created" and event_id not in seen and include_created(view):
+                result.append({**view, 'id': event_id})
+        return result
+
+    # --- Failures and flushing ---
+
+    def drain_failures(self, owner: str | None = None):
+        """
+        Returns and clears the writes that failed since the last call.
+        With an owner, only the writes made for that user (or for no one in particular) are returned.
+        """
+        drained, kept = [], []
+        with self._cond:
+            for failure in self._failures:
+                owners = failure["owners"]
+                if owner is not None and owners and owner not in owners:
+                    kept.append(failure)
+                    continue
+                drained.append({key: value for key, value in failure.items() if key != "owners"})
+                # Other users who touched the same event still get to hear about it
+                owners.discard(owner)
+                if owner is not None and owners:
+                    kept.append(failure)
+            self._failures = kept
+        return drained
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Writes all pending operations now and waits until they are done. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._force = True
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(timeout=remaining)
+            self._force = False
+            return not (self._pending or self._in_flight)
+
+    # --- Internals ---
+
+    def _enqueue(self, event_id: str, action: str, body: dict | None, etag: str | None = None):
+        with self._cond:
+            entry = self._pending.get(event_id)
+            if entry is None:
+                entry = self._pending[event_id] = {"ops": [], "owners": set(), "enqueued_at": time.monotonic()}
+            if WRITE_OWNER.get() is not None:
+                entry["owners"].add(WRITE_OWNER.get())
+            self._coalesce(entry["ops"], action, body, etag)
+            if not entry["ops"]:
+                del self._pending[event_id]
+            self._cond.notify_all()
+
+    @staticmethod
+    def _coalesce(ops: list, action: str, body: dict | None, etag: str | None):
+        """
+        Merges the new operation into the last queued operation of the same event where possible.
+        A merged update keeps the ETag of the first update, i.e. the version the edits were based on.
+        """
+        last = ops[-1] if ops else None
+        if last is None or last[0] == "delete":
+            ops.append((action, body, etag))
+        elif action == "update":
+            ops[-1] = (last[0], {**last[1], **body}, last[2] or etag)
+        elif action == "replace" and last[0] == "create":
+            # The event never reached Google, so it is created as replaced
+            ops[-1] = ("create", {**body, 'id': last[1]['id']}, None)
+        elif action == "replace":
+            ops[-1] = ("replace", body, None)
+        elif action == "delete" and last[0] == "create":
+            # The event never reached Google, so there is nothing to do
+            ops.pop()
+        elif action == "delete":
+            ops[-1] = ("delete", None, None)
+        else:
+            ops.append((action, body, etag))
+
+    def _touched_ids(self):
+        ids = list(self._pending)
+        if self._in_flight:
+            ids.insert(0, self._in_flight[0])
+        return ids
+
+    def _local_view(self, event_id: str | None):
+        """
+        Folds the in-flight and pending operations of one event.
+        Returns (state, body): state is None, "created", "updated" or "deleted".
+        """
+        with self._cond:
+            ops = []
+            if self._in_flight and self._in_flight[0] == event_id:
+                ops.extend(self._in_flight[1])
+            if event_id in self._pending:
+                ops.extend(self._pending[event_id]["ops"])
+
+        state, view = None, None
+        for action, body, _ in ops:
+            if action == "create":
+                state, view = "created", dict(body)
+            elif action == "update":
+                state = state if state == "created" else "updated"
+                view = {**(view or {}), **body}
+            elif action == "replace":
+                state = state if state == "created" else "updated"
+                view = dict(body)
+            else:
+                state, view = "deleted", None
+        return state, view
+
+    def _next_ready(self):
+        if not self._pending:
+            return None
+        event_id, entry = next(iter(self._pending.items()))
+        if not self._force and time.monotonic() - entry["enqueued_at"] < self.flush_delay:
+            return None
+        del self._pending[event_id]
+        return event_id, entry["ops"], entry["owners"]
+
+    def _wait_time(self):
+        if not self._pending:
+            return None
+        entry = next(iter(self._pending.values()))
+        return max(0.0, self.flush_delay - (time.monotonic() - entry["enqueued_at"]))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                ready = self._next_ready()
+                while ready is None:
+                    self._cond.wait(timeout=self._wait_time())
+                    ready = self._next_ready()
+                event_id, ops, owners = ready
+                self._in_flight = (event_id, ops)
+
+            for action, body, etag in ops:
+                try:
+                    etag = self._current_etag(event_id, etag)
+                    result = self._apply(event_id, action, copy.deepcopy(body), etag)
+                    self._remember_etag(event_id, action, etag, result)
+                except Exception as e:
+                    logger.error("Write-behind '%s' for event '%s' failed: %s", action, event_id, e)
+                    with self._cond:
+                        self._failures.append({
+                            "owners": set(owners),
+                            "event_id": event_id,
+                            "action": action,
+                            "summary": (body or {}).get('summary'),
+                            "error": str(e),
+                        })
+                    # Later operations on the same event depend on this one
+                    break
+
+            with self._cond:
+                self._in_flight = None
+                self._cond.notify_all()
+
+    def _current_etag(self, event_id: str, etag: str | None):
+        """
+        The ETag to send with an update. An edit based on a version that our own earlier flushed
+        write replaced is based on the version that write produced, not on someone else's change.
+        """
+        known = self._own_etags.get(event_id)
+        if etag and known and etag in known[0]:
+            return known[1]
+        return etag
+
+    def _remember_etag(self, event_id: str, action: str, etag: str | None, result):
+        if action == "delete":
+            self._own_etags.pop(event_id, None)
+            return
+        if not etag or not isinstance(result, dict) or not result.get('etag'):
+            return
+        superseded, _ = self._own_etags.pop(event_id, (set(), None))
+        superseded.add(etag)
+        self._own_etags[event_id] = (superseded, result['etag'])
+        while len(self._own_etags) > MAX_TRACKED_ETAGS:
+            self._own_etags.popitem(last=False)
+
+    def _apply(self, event_id: str, action: str, body: dict | None, etag: str | None):
+        if action == "create":
+            return self.calendar_service.insert_event(event_body=body)
+        elif action == "update":
+            return self.calendar_service.update_event(event_id=event_id, updated_data=body, etag=etag)
+        elif action == "replace":
+            return self.calendar_service.replace_event(event_id=event_id, event_data=body)
+        else:
+            return self.calendar_service.delete_event(event_id=event_id)
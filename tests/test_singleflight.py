@@ -0,0 +1,127 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from singleflight import SingleFlight
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not reached in time.")
+        time.sleep(0.001)
+
+
+class SingleFlightTest(unittest.TestCase):
+    CALLERS = 8
+
+    def run_concurrently(self, flight, fn, count, **kwargs):
+        """Calls flight.do('key', fn) from count threads; returns the results and errors of all callers."""
+        results, errors = [], []
+        lock = threading.Lock()
+
+        def call():
+            try:
+                result = flight.do("key", fn, **kwargs)
+                with lock:
+                    results.append(result)
+            except BaseException as e:
+                with lock:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return {"events": [1, 2, 3]}
+
+        threads, results, errors = self.run_concurrently(flight, fn, self.CALLERS)
+        # Let the leader finish only once every other caller joined it
+        wait_until(lambda: flight.shared == self.CALLERS - 1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [{"events": [1, 2, 3]}] * self.CALLERS)
+
+    def test_error_reaches_every_follower(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fn():
+            release.wait(5)
+            raise ValueError("calendar unavailable")
+
+        threads, results, errors = self.run_concurrently(flight, fn, self.CALLERS)
+        wait_until(lambda: flight.shared == self.CALLERS - 1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), self.CALLERS)
+        self.assertTrue(all(isinstance(error, ValueError) for error in errors))
+
+    def test_followers_get_independent_copies(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fn():
+            release.wait(5)
+            return {"events": [{"summary": "Standup"}]}
+
+        threads, results, errors = self.run_concurrently(flight, fn, self.CALLERS)
+        wait_until(lambda: flight.shared == self.CALLERS - 1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(errors, [])
+        results[0]["events"][0]["summary"] = "Changed"
+        results[1]["events"].append({"summary": "Added"})
+        for result in results[2:]:
+            self.assertEqual(result, {"events": [{"summary": "Standup"}]})
+        self.assertEqual(len({id(result) for result in results}), self.CALLERS)
+
+    def test_follower_times_out(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        started = threading.Event()
+
+        def fn():
+            started.set()
+            release.wait(5)
+            return "done"
+
+        leader = threading.Thread(target=flight.do, args=("key", fn))
+        leader.start()
+        started.wait(5)
+        try:
+            with self.assertRaises(TimeoutError):
+                flight.do("key", fn, timeout=0.05)
+        finally:
+            release.set()
+            leader.join(5)
+
+        # The key is free again once the leader finished
+        self.assertEqual(flight.do("key", lambda: "fresh"), "fresh")
+
+
+if __name__ == "__main__":
+    unittest.main()